@@ -1,5 +1,7 @@
+import numpy as np
 
-def check_crc(bits91_int):
+def check_crc_bitwise(bits91_int):
+    # Bit-at-a-time reference implementation of check_crc
     bits77_int = bits91_int >> 14
     if(bits77_int > 0):
         crc14_int = 0
@@ -12,7 +14,7 @@ def check_crc(bits91_int):
         if(crc14_int == bits91_int & 0b11111111111111):
             return bits77_int
 
-def _crc14(bits77_int: int) -> int:
+def _crc14_bitwise(bits77_int: int) -> int:
     # Generator polynomial (0x2757), width 14, init=0, refin=false, refout=false
     poly = 0x2757
     width = 14
@@ -29,6 +31,64 @@ def _crc14(bits77_int: int) -> int:
             reg_int ^= poly
     return reg_int
 
+CRC14_POLY = 0x2757
+CRC14_MASK = (1 << 14) - 1
+
+def _make_crc14_table():
+    table = []
+    for byte in range(256):
+        reg = byte << 6
+        for _ in range(8):
+            reg = ((reg << 1) ^ CRC14_POLY) if reg & 0x2000 else (reg << 1)
+        table.append(reg & CRC14_MASK)
+    return table
+
+CRC14_TABLE = _make_crc14_table()
+
+def _crc14(bits77_int: int) -> int:
+    # Table-driven, byte at a time. The 77 message bits are followed by 5 zero bits (82 bits, as WSJT-X)
+    # and left-padded to 11 bytes; leading zeros don't change the CRC.
+    reg_int = 0
+    for byte in (bits77_int << 5).to_bytes(11, 'big'):
+        reg_int = ((reg_int << 8) & CRC14_MASK) ^ CRC14_TABLE[((reg_int >> 6) ^ byte) & 0xFF]
+    return reg_int
+
+def check_crc(bits91_int):
+    bits77_int = bits91_int >> 14
+    if(bits77_int > 0):
+        if(_crc14(bits77_int) == bits91_int & CRC14_MASK):
+            return bits77_int
+
+def _make_crc14_position_tables():
+    # The CRC is linear in the message, so the CRC of the 11 padded bytes is the XOR of
+    # one table lookup per byte position
+    tables = np.zeros((11, 256), dtype=np.uint16)
+    for pos in range(11):
+        for byte in range(256):
+            reg_int = 0
+            for b in bytes(pos) + bytes([byte]) + bytes(10 - pos):
+                reg_int = ((reg_int << 8) & CRC14_MASK) ^ CRC14_TABLE[((reg_int >> 6) ^ b) & 0xFF]
+            tables[pos, byte] = reg_int
+    return tables
+
+CRC14_POSITION_TABLES = _make_crc14_position_tables()
+
+def check_crc_batch(bits91):
+    """Check the CRC of many 91-bit codewords in one call.
+    bits91 is either an (N, 91) array of bits, MSB first, or the same packed with np.packbits to (N, 12) uint8.
+    Returns a boolean array, True where the CRC matches and the 77-bit message is non-zero (as check_crc)."""
+    bits91 = np.asarray(bits91)
+    if bits91.shape[1] == 12 and bits91.dtype == np.uint8:
+        bits91 = np.unpackbits(bits91, axis=1)[:, :91]
+    bits91 = bits91.astype(np.uint8)
+    nrows = bits91.shape[0]
+    padded = np.zeros((nrows, 88), dtype=np.uint8)
+    padded[:, 6:83] = bits91[:, :77]
+    packed = np.packbits(padded, axis=1)
+    crc = np.bitwise_xor.reduce(CRC14_POSITION_TABLES[np.arange(11), packed], axis=1)
+    rx_crc = bits91[:, 77:91].astype(np.uint16) @ (1 << np.arange(13, -1, -1)).astype(np.uint16)
+    return (crc == rx_crc) & np.any(bits91[:, :77], axis=1)
+
 def append_crc(bits77_int):
     """Append 14-bit WSJT-X CRC to a 77-bit message, returning a 91-bit list."""
     bits14_int = _crc14(bits77_int)
@@ -1,10 +1,14 @@
 import numpy as np
-from PyFT8.FT8_crc import append_crc
+from PyFT8.FT8_crc import append_crc, _crc14
 from PyFT8.sigspecs import FT8
 
 generator_matrix_rows = ["8329ce11bf31eaf509f27fc",  "761c264e25c259335493132",  "dc265902fb277c6410a1bdc",  "1b3f417858cd2dd33ec7f62",  "09fda4fee04195fd034783a",  "077cccc11b8873ed5c3d48a",  "29b62afe3ca036f4fe1a9da",  "6054faf5f35d96d3b0c8c3e",  "e20798e4310eed27884ae90",  "775c9c08e80e26ddae56318",  "b0b811028c2bf997213487c",  "18a0c9231fc60adf5c5ea32",  "76471e8302a0721e01b12b8",  "ffbccb80ca8341fafb47b2e",  "66a72a158f9325a2bf67170",  "c4243689fe85b1c51363a18",  "0dff739414d1a1b34b1c270",  "15b48830636c8b99894972e",  "29a89c0d3de81d665489b0e",  "4f126f37fa51cbe61bd6b94",  "99c47239d0d97d3c84e0940",  "1919b75119765621bb4f1e8",  "09db12d731faee0b86df6b8",  "488fc33df43fbdeea4eafb4",  "827423ee40b675f756eb5fe",  "abe197c484cb74757144a9a",  "2b500e4bc0ec5a6d2bdbdd0",  "c474aa53d70218761669360",  "8eba1a13db3390bd6718cec",  "753844673a27782cc42012e",  "06ff83a145c37035a5c1268",  "3b37417858cc2dd33ec3f62",  "9a4a5a28ee17ca9c324842c",  "bc29f465309c977e89610a4",  "2663ae6ddf8b5ce2bb29488",  "46f231efe457034c1814418",  "3fb2ce85abe9b0c72e06fbe",  "de87481f282c153971a0a2e",  "fcd7ccf23c69fa99bba1412",  "f0261447e9490ca8e474cec",  "4410115818196f95cdd7012",  "088fc31df4bfbde2a4eafb4",  "b8fef1b6307729fb0a078c0",  "5afea7acccb77bbc9d99a90",  "49a7016ac653f65ecdc9076",  "1944d085be4e7da8d6cc7d0",  "251f62adc4032f0ee714002",  "56471f8702a0721e00b12b8",  "2b8e4923f2dd51e2d537fa0",  "6b550a40a66f4755de95c26",  "a18ad28d4e27fe92a4f6c84",  "10c2e586388cb82a3d80758",  "ef34a41817ee02133db2eb0",  "7e9c0c54325a9c15836e000",  "3693e572d1fde4cdf079e86",  "bfb2cec5abe1b0c72e07fbe",  "7ee18230c583cccc57d4b08",  "a066cb2fedafc9f52664126",  "bb23725abc47cc5f4cc4cd2",  "ded9dba3bee40c59b5609b4",  "d9a7016ac653e6decdc9036",  "9ad46aed5f707f280ab5fc4",  "e5921c77822587316d7d3c2",  "4f14da8242a8b86dca73352",  "8b8b507ad467d4441df770e",  "22831c9cf1169467ad04b68",  "213b838fe2ae54c38ee7180",  "5d926b6dd71f085181a4e12",  "66ab79d4b29ee6e69509e56",  "958148682d748a38dd68baa",  "b8ce020cf069c32a723ab14",  "f4331d6d461607e95752746",  "6da23ba424b9596133cf9c8",  "a636bcbc7b30c5fbeae67fe",  "5cb0d86a07df654a9089a20",  "f11f106848780fc9ecdd80a",  "1fbb5364fb8d2c9d730d5ba",  "fcb86bc70a50c9d02a5d034",  "a534433029eac15f322e34c",  "c989d9c7c3d3b8c55d75130",  "7bb38b2f0186d46643ae962",  "2644ebadeb44b9467d1f42c",  "608cc857594bfbb55d69600"]
 kGEN = np.array([int(row,16)>>1 for row in generator_matrix_rows])
 
+from string import ascii_uppercase as ltrs, digits as digs
+C28_CHARMAP = [' ' + digs + ltrs, digs + ltrs, digs + ' ' * 17] + [' ' + ltrs] * 3
+C28_FACTORS = [36*10*27**3, 10*27**3, 27**3, 27**2, 27, 1]
+
 
 def pack_message(c1, c2, gr):
     symbols, bits77 = _pack_message(c1, c2, gr)
@@ -32,20 +36,17 @@ def pack_ft8_c28(call):
         p1 = 1
         call = call[:-2]
     
-    from string import ascii_uppercase as ltrs, digits as digs
     if(call[1].isdigit() and not call[2].isdigit()): call = ' ' + call
     if (call[-4].isdigit()):
         call = call + ' '
     elif (call[-3].isdigit()):
         call = call + '  '
-    charmap = [' ' + digs + ltrs, digs + ltrs, digs + ' ' * 17] + [' ' + ltrs] * 3
-    factors = np.array([36*10*27**3, 10*27**3, 27**3, 27**2, 27, 1])
     try:
-        indices = np.array([cmap.index(call[i]) for i, cmap in enumerate(charmap)])
+        c28 = sum(factor * cmap.index(call[i]) for i, (cmap, factor) in enumerate(zip(C28_CHARMAP, C28_FACTORS)))
     except:
         print(f"Couldn't encode {call}")
         return -1, 0 
-    c28 =  int(np.sum(factors * indices) + 2_063_592 + 4_194_304)
+    c28 =  c28 + 2_063_592 + 4_194_304
     return c28, p1
 
 def pack_ft8_g15(txt):
@@ -83,17 +84,12 @@ def ldpc_encode(msg_crc: int) -> int:
     msg_crc = int(msg_crc)
     parity_bits = 0
     for row in map(int, kGEN):
-        bit = bin(msg_crc & row).count("1") & 1
+        bit = (msg_crc & row).bit_count() & 1
         parity_bits = (parity_bits << 1) | bit
     return (msg_crc << 83) | parity_bits, parity_bits
 
 def gray_encode(bits: int) -> list[int]:
-    syms = []
-    for _ in range(174 // 3):
-        chunk = bits & 0x7
-        syms.insert(0, FT8.gray_seq[chunk])
-        bits >>= 3
-    return syms
+    return [FT8.gray_seq[(bits >> (3 * i)) & 0x7] for i in range(174 // 3 - 1, -1, -1)]
 
 def add_costas(syms: list[int]) -> list[int]:
     return FT8.costas + syms[:29] + FT8.costas + syms[29:] + FT8.costas
@@ -105,6 +101,63 @@ def encode_bits77(bits77_int):
     symbols = add_costas(syms)
     return symbols, bits174_int, bits91_int, bits14_int, bits83_int
 
+def _gf2_byte_tables(matrix):
+    # Per-input-byte lookup tables for a GF(2) matrix multiply on packed bits: row k of matrix is the
+    # (packed) output for input bit k, so the product is the XOR of one table entry per input byte
+    nin, nout = matrix.shape
+    nbytes_in = (nin + 7) // 8
+    rows = np.zeros((nbytes_in * 8, nout), dtype=np.uint8)
+    rows[:nin] = matrix
+    rows = np.packbits(rows, axis=1)
+    byte_bits = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1)
+    tables = np.zeros((nbytes_in, 256, rows.shape[1]), dtype=np.uint8)
+    for pos in range(nbytes_in):
+        for bit in range(8):
+            tables[pos, byte_bits[:, bit] == 1] ^= rows[pos * 8 + bit]
+    return tables
+
+def _gf2_multiply(bits, tables, nout):
+    packed = np.packbits(bits, axis=1)
+    out = np.bitwise_xor.reduce(tables[np.arange(packed.shape[1]), packed], axis=1)
+    return np.unpackbits(out, axis=1)[:, :nout]
+
+CRC14_TABLES = _gf2_byte_tables(np.array([[(_crc14(1 << (76 - i)) >> (13 - j)) & 1 for j in range(14)] for i in range(77)], dtype=np.uint8))
+LDPC_TABLES = _gf2_byte_tables(np.array([[(int(row) >> (90 - i)) & 1 for row in kGEN] for i in range(91)], dtype=np.uint8))
+COSTAS_SYMBOLS = np.array(FT8.costas, dtype=np.uint8)
+GRAY_SEQ = np.array(FT8.gray_seq, dtype=np.uint8)
+
+def encode_bits77_batch(bits77):
+    """Encode an (N, 77) array of message bits (MSB first) to an (N, 79) array of channel symbols."""
+    bits77 = np.asarray(bits77, dtype=np.uint8)
+    bits91 = np.hstack((bits77, _gf2_multiply(bits77, CRC14_TABLES, 14)))
+    bits174 = np.hstack((bits91, _gf2_multiply(bits91, LDPC_TABLES, 83)))
+    syms = GRAY_SEQ[bits174.reshape(-1, 58, 3) @ np.array([4, 2, 1], dtype=np.uint8)]
+    costas = np.broadcast_to(COSTAS_SYMBOLS, (len(syms), len(COSTAS_SYMBOLS)))
+    return np.hstack((costas, syms[:, :29], costas, syms[:, 29:], costas))
+
+def pack_messages(msgs):
+    """Bulk version of pack_message for an iterable of (c1, c2, gr) tuples.
+    Returns an (N, 79) uint8 symbol array and a boolean array marking the messages that could be packed
+    (rows for the others are zero)."""
+    c28_cache, g15_cache = {}, {}
+    fields = []
+    for c1, c2, gr in msgs:
+        for call in (c1, c2):
+            if call not in c28_cache:
+                c28_cache[call] = pack_ft8_c28(call)
+        if gr not in g15_cache:
+            g15_cache[gr] = pack_ft8_g15(gr)
+        fields.append(c28_cache[c1] + c28_cache[c2] + g15_cache[gr])
+    fields = np.array(fields, dtype=np.int64).reshape(-1, 6)
+    valid = (fields[:, 0] >= 0) & (fields[:, 2] >= 0)
+    c28a, p1a, c28b, p1b, g15, ir = (np.where(valid, fields[:, i], 0) for i in range(6))
+    i3 = np.ones(len(fields), dtype=np.int64)
+    bits77 = np.hstack([(v[:, None] >> np.arange(w - 1, -1, -1)) & 1 for v, w in
+                        zip((c28a, p1a, c28b, p1b, ir, g15, i3), (28, 1, 28, 1, 1, 15, 3))])
+    symbols = encode_bits77_batch(bits77)
+    symbols[~valid] = 0
+    return symbols, valid
+
 def loopback_test():
     msgs = [("G1OJS/P", "G1OJS/P", "IO90"),("WM3PEN","EA6VQ","-08"),("E67A/P","EA6VQ","-08"),("CQ","CT7ARQ/P","IN51")]
     for msg in msgs:
@@ -1,11 +1,21 @@
 
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from string import ascii_uppercase as ltrs, digits as digs
 CALL_FIELDS = [ (' ' + digs + ltrs, 36*10*27**3),   (digs + ltrs, 10*27**3), (digs + ' ' * 17, 27**3),
                 (' ' + ltrs, 27**2),           (' ' + ltrs,   27), (' ' + ltrs,   1) ]
 CALL_TOKENS = ("DE", "QRZ", "CQ")
-NCALL_TOKENS_PLUS_MAX22 = 2_063_592 + 4_194_304
+NTOKENS = 2_063_592
+MAX22 = 4_194_304
+NCALL_TOKENS_PLUS_MAX22 = NTOKENS + MAX22
 GRID_RR73s = ('', '', 'RRR', 'RR73', '73')
+R2_TOKENS = ('', 'RRR', 'RR73', '73')
+C58_ALPHABET = ' ' + digs + ltrs + '/'
+FREE_TEXT_ALPHABET = ' ' + digs + ltrs + '+-./?'
 FT8_MSG_FORMAT = (("i3", 3), ("grid", 16), ("callB",29), ("callA",29))
+NONSTD_MSG_FORMAT = (("i3", 3), ("cq", 1), ("r2", 2), ("h1", 1), ("c58", 58), ("h12", 12))
+DXPEDITION_MSG_FORMAT = (("n3", 3), ("r5", 5), ("h10", 10), ("callB", 28), ("callA", 28))
 
 def get_fields(bits, fmt):
     out = {}
@@ -15,25 +25,134 @@ def get_fields(bits, fmt):
         bits >>= n
     return out
 
+@lru_cache(maxsize = 4096)
+def call_hashes(call):
+    """The 22, 12 and 10-bit hashes of a callsign, as WSJT-X's ihashcall."""
+    n = 0
+    for c in call.ljust(11)[:11]:
+        n = 38 * n + max(C58_ALPHABET.find(c), 0)
+    n = (47_055_833_459 * n) & 0xFFFF_FFFF_FFFF_FFFF
+    return n >> 42, n >> 52, n >> 54
+
+class CallHashTable:
+    """Bounded table of callsigns heard on air, indexed by their 22, 12 and 10-bit hashes so that
+    hashed calls in later messages resolve to <CALL> rather than <...>."""
+    def __init__(self, max_calls = 1000):
+        self.max_calls = max_calls
+        self.calls = OrderedDict()      # call -> hashes, least recently heard first
+        self.tables = {22: {}, 12: {}, 10: {}}
+        self.lookups, self.hits = 0, 0
+        self.lock = threading.Lock()
+
+    def add(self, call):
+        with self.lock:
+            if call in self.calls:
+                self.calls.move_to_end(call)
+                return
+            hashes = call_hashes(call)
+            self.calls[call] = hashes
+            for nbits, h in zip((22, 12, 10), hashes):
+                self.tables[nbits][h] = call
+            if len(self.calls) > self.max_calls:
+                old, old_hashes = self.calls.popitem(last = False)
+                for nbits, h in zip((22, 12, 10), old_hashes):
+                    if self.tables[nbits].get(h) == old:
+                        del self.tables[nbits][h]
+
+    def lookup(self, h, nbits):
+        with self.lock:
+            self.lookups += 1
+            call = self.tables[nbits].get(h)
+            if call is None:
+                return '<...>'
+            self.hits += 1
+            return f'<{call}>'
+
+    def stats(self):
+        with self.lock:
+            return {'calls': len(self.calls), 'lookups': self.lookups, 'hits': self.hits,
+                    'hit_rate': self.hits / self.lookups if self.lookups else 0.0}
+
+global_call_hashes = CallHashTable()
+
 def unpack(bits77):
-    fields = get_fields(bits77, FT8_MSG_FORMAT)
-    return (decode_call(fields["callA"]), decode_call(fields["callB"]), decode_grid(fields["grid"]))
+    """Unpack a 77-bit message to a tuple of words. Handles standard messages (i3 = 1, 2), non-standard
+    calls (i3 = 4), free text, DXpedition and telemetry (i3 = 0)."""
+    i3 = bits77 & 7
+    if i3 in (1, 2):
+        fields = get_fields(bits77, FT8_MSG_FORMAT)
+        return (decode_call(fields["callA"]), decode_call(fields["callB"]), decode_grid(fields["grid"]))
+    if i3 == 4:
+        return unpack_nonstandard(get_fields(bits77, NONSTD_MSG_FORMAT))
+    if i3 == 0:
+        n3, bits71 = (bits77 >> 3) & 7, bits77 >> 6
+        if n3 == 0:
+            return (decode_free_text(bits71),)
+        if n3 == 1:
+            fields = get_fields(bits77 >> 3, DXPEDITION_MSG_FORMAT)
+            return (decode_call(fields["callA"] << 1), 'RR73;', decode_call(fields["callB"] << 1),
+                    global_call_hashes.lookup(fields["h10"], 10), f"{2 * fields['r5'] - 30:+03d}")
+        if n3 == 5:
+            return (f"{bits71:018X}".lstrip('0') or '0',)
+    return (f"<i3={i3}>",)
+
+def unpack_nonstandard(fields):
+    call = decode_c58(fields["c58"])
+    global_call_hashes.add(call)
+    if fields["cq"]:
+        return ('CQ', call, '')
+    hashed = global_call_hashes.lookup(fields["h12"], 12)
+    calls = (call, hashed) if fields["h1"] else (hashed, call)
+    return calls + (R2_TOKENS[fields["r2"]],)
 
 def decode_call(call_int):
     portable = call_int & 1
     call_int >>= 1
     if call_int < 3:
         return CALL_TOKENS[call_int]
-    call_int -= NCALL_TOKENS_PLUS_MAX22
-    if call_int == 0:
-        return '<...>'
+    if call_int < 1003:
+        return f"CQ {call_int - 3:03d}"
+    if call_int < NTOKENS:
+        return "CQ " + decode_cq_suffix(call_int - 1003)
+    if call_int < NCALL_TOKENS_PLUS_MAX22:
+        return global_call_hashes.lookup(call_int - NTOKENS, 22)
+    call = decode_standard_call(call_int - NCALL_TOKENS_PLUS_MAX22)
+    if portable:
+        call += '/P'
+    global_call_hashes.add(call)
+    return call
+
+@lru_cache(maxsize = 4096)
+def decode_standard_call(call_int):
     chars = []
     for alphabet, div in CALL_FIELDS:
         idx, call_int = divmod(call_int, div)
         chars.append(alphabet[idx])
-    call = ''.join(chars).strip()
-    return call + '/P' if portable else call
+    return ''.join(chars).strip()
+
+def decode_cq_suffix(n):
+    chars = []
+    for _ in range(4):
+        n, idx = divmod(n, 27)
+        chars.append((' ' + ltrs)[idx])
+    return ''.join(reversed(chars)).strip()
+
+@lru_cache(maxsize = 1024)
+def decode_c58(c58):
+    chars = []
+    for _ in range(11):
+        c58, idx = divmod(c58, 38)
+        chars.append(C58_ALPHABET[idx])
+    return ''.join(reversed(chars)).strip()
+
+def decode_free_text(bits71):
+    chars = []
+    for _ in range(13):
+        bits71, idx = divmod(bits71, 42)
+        chars.append(FREE_TEXT_ALPHABET[idx])
+    return ''.join(reversed(chars)).strip()
 
+@lru_cache(maxsize = 4096)
 def decode_grid(grid_int):
     g15 = grid_int & 0x7FFF
     if g15 < 32400:
@@ -49,3 +168,9 @@ def decode_grid(grid_int):
     prefix = 'R' if ir else ''
     return prefix + f"{snr:+03d}"
 
+def cache_stats():
+    """Hit counts of the memoized field decoders, plus the callsign hash table's."""
+    info = [f.cache_info() for f in (decode_standard_call, decode_c58, decode_grid)]
+    hits, misses = sum(i.hits for i in info), sum(i.misses for i in info)
+    return {'unpack_cache_hits': hits, 'unpack_cache_misses': misses,
+            'unpack_cache_size': sum(i.currsize for i in info), 'call_hashes': global_call_hashes.stats()}
@@ -2,26 +2,50 @@
 from PyFT8.cycle_manager import Cycle_manager
 from PyFT8.sigspecs import FT8
 import argparse
+import os
 import time
 import signal
 
-global concise
+global concise, decode_log, control_server
 concise = False
+decode_log = None
+control_server = None
 def on_decode(dd):
+    if(decode_log):
+        decode_log.on_decode(dd)
+    if(control_server):
+        control_server.on_decode(dd)
     if(concise):
         print(f"{dd['cs']} {dd['snr']} {dd['dt']} {dd['f']} ~ {dd['msg']}")
     else:
         print(dd)
 
 def cli():
-    global concise
+    global concise, decode_log, control_server
     parser = argparse.ArgumentParser(prog='PyFT8rx', description = 'Command Line FT8 decoder')
     parser.add_argument('-i', '--inputcard_keywords', help = 'Comma-separated keywords to identify the input sound device') 
     parser.add_argument('-c','--concise', action='store_true', help = 'Concise output') 
     parser.add_argument('-o','--outputcard_keywords', help = 'Comma-separated keywords to identify the output sound device') 
     parser.add_argument('-v','--verbose',  action='store_true',  help = 'Verbose: include debugging output')
-    parser.add_argument('-tx','--transmit_message', nargs='?', help = 'Transmit a message')
+    parser.add_argument('-tx','--transmit_message', nargs='?', help = 'Transmit a message (sent to the running receiver\'s control socket if -o is given, otherwise written to a wave file)')
+    parser.add_argument('-tf','--tx_freq', type = int, default = 1000, help = 'Transmit audio frequency (Hz)')
+    parser.add_argument('-cs','--control', default = '127.0.0.1:2238', help = 'Control socket (host:port for UDP, or a Unix socket path) for tx, cancel and status commands; \'\' for none')
+    parser.add_argument('-wu','--wsjtx_udp', help = 'Send decodes to local apps at this host:port as WSJT-X UDP messages (e.g. 127.0.0.1:2237)')
     parser.add_argument('-wo','--wave_output_file', nargs='?', help = 'Wave output file', default = 'PyFT8_tx_wav.wav')
+    parser.add_argument('-wi','--wave_input', help = 'Decode a wav file, or all wav files in a directory, as fast as possible and exit')
+    parser.add_argument('-dw','--decode_workers', type = int, default = 0, help = 'Number of decode worker processes (default: decode in the receiver thread)')
+    parser.add_argument('-m','--metrics_file', help = 'Write Prometheus metrics to this file after each cycle')
+    parser.add_argument('-p','--passes', type = int, default = 1, help = 'Decode passes per cycle, subtracting decoded signals between passes')
+    parser.add_argument('-s','--spectrum_shm', help = 'Publish spectrum rows to a shared memory ring with this name, for viewers in other processes (NAME_RECEIVER for each -rx receiver)')
+    parser.add_argument('-a','--archive', help = 'Archive each cycle\'s spectrogram to this directory (a subdirectory for each -rx receiver)')
+    parser.add_argument('-ra','--replay_archive', help = 'Decode every cycle in a spectrogram archive directory and exit')
+    parser.add_argument('-r','--record', help = 'Record the input audio to one wav file per cycle in this directory (a subdirectory for each -rx receiver)')
+    parser.add_argument('-at','--all_txt', help = 'Append decodes to this file in WSJT-X ALL.TXT format')
+    parser.add_argument('-jl','--jsonl', help = 'Append decodes to this file as JSON lines')
+    parser.add_argument('-db','--database', help = 'Insert decodes into this SQLite database')
+    parser.add_argument('-f','--dial_mhz', type = float, default = 0.0, help = 'Dial frequency (MHz) written to ALL.TXT')
+    parser.add_argument('-rx','--receiver', action = 'append', help = 'Add a receiver NAME[:CHANNEL[:KEYWORDS]] (default keywords from -i); repeat to run several receivers sharing the decode workers')
+    parser.add_argument('-j','--jobs', type = int, help = 'Number of worker processes for --wave_input (default: one per CPU)')
     
     
     args = parser.parse_args()
@@ -31,13 +55,39 @@ def cli():
     output_device_keywords = args.outputcard_keywords.replace(' ','').split(',') if args.outputcard_keywords is not None else None
     transmit_message = args.transmit_message
     wave_output_file = args.wave_output_file
+    if(args.all_txt or args.jsonl or args.database):
+        from PyFT8.decode_log import DecodeLog
+        decode_log = DecodeLog(args.all_txt, args.jsonl, args.database, args.dial_mhz)
+    live = not (args.wave_input or args.replay_archive or transmit_message)
+    if(live and (args.control or args.wsjtx_udp)):
+        # Bound before the receiver opens its audio and waits for the rollover, so a clash shows straight away
+        from PyFT8.control import ControlServer
+        try:
+            control_server = ControlServer(None, args.control or None, args.wsjtx_udp)
+        except OSError as e:
+            parser.error(f"can't use control socket {args.control} ({e}); pass another with --control, or --control '' for none")
 
-    if(transmit_message):
+    if(args.wave_input):
+        from PyFT8.offline import find_wav_files, decode_wav_files
+        nfiles, ndecodes, elapsed = decode_wav_files(find_wav_files(args.wave_input), on_decode, workers = args.jobs, passes = args.passes)
+        print(f"Decoded {nfiles} files in {elapsed:.1f}s ({ndecodes} decodes, {nfiles * 15 / max(elapsed, 1e-6):.0f}x real time)")
+    elif(args.replay_archive):
+        from PyFT8.offline import decode_archive
+        ncycles, ndecodes, elapsed = decode_archive(args.replay_archive, on_decode, passes = args.passes)
+        print(f"Decoded {ncycles} archived cycles in {elapsed:.1f}s ({ndecodes} decodes)")
+    elif(transmit_message):
         if(output_device_keywords):
-            print(f"Transmitting {transmit_message} on next cycle (in {15 - time.time() % 15 :3.1f}s)")
-            tx_msg_file = 'PyFT8_tx_msg.txt'
-            with open('PyFT8_tx_msg.txt','w') as f:
-                f.write(transmit_message)
+            if(not args.control):
+                parser.error("-tx with -o sends the message to a running receiver's control socket, so needs --control")
+            from PyFT8.control import send_command
+            try:
+                reply = send_command(args.control, 'tx', msg = transmit_message, freq = args.tx_freq)
+            except OSError as e:
+                reply = {'ok': False, 'error': f"no receiver listening on {args.control} ({e})"}
+            if(reply['ok']):
+                print(f"Transmitting {transmit_message} on next cycle (in {15 - time.time() % 15 :3.1f}s)")
+            else:
+                print(f"Can't transmit: {reply['error']}")
         else:
             from PyFT8.audio import AudioOut
             audio_out = AudioOut()
@@ -45,12 +95,48 @@ def cli():
             wf = audio_out.create_ft8_wave(symbols)
             audio_out.write_to_wave_file(wf, wave_output_file)
             print(f"Created wave file '{wave_output_file}' with message '{transmit_message}'")
+    elif(args.receiver):
+        from PyFT8.multi_receiver import MultiReceiver
+        receivers = []
+        for spec in args.receiver:
+            name, channel, keywords = (spec.split(':', 2) + ['', ''])[:3]
+            receiver = {'receiver': name, 'input_channel': int(channel or 0),
+                        'input_device_keywords': keywords.replace(' ','').split(',') if keywords else input_device_keywords}
+            # one archive and recording directory, and one spectrum ring, per receiver
+            safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name) or str(len(receivers))
+            if(args.archive):
+                receiver['archive'] = os.path.join(args.archive, safe_name)
+            if(args.record):
+                receiver['record'] = os.path.join(args.record, safe_name)
+            if(args.spectrum_shm):
+                receiver['spectrum_shm'] = f"{args.spectrum_shm}_{safe_name}"
+            receivers.append(receiver)
+        receivers[0]['output_device_keywords'] = output_device_keywords
+        multi_receiver = MultiReceiver(FT8, on_decode, receivers, decode_workers = args.decode_workers, verbose = verbose,
+                                       metrics_file = args.metrics_file, passes = args.passes)
+        if(control_server):
+            control_server.cycle_manager = multi_receiver.managers[0]
+        print(f"PyFT8 Rx running {len(receivers)} receivers — Ctrl-C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("\nStopping PyFT8 Rx")
     else:
         cycle_manager = Cycle_manager(FT8, on_decode = on_decode, input_device_keywords = input_device_keywords,
-                                  output_device_keywords = output_device_keywords, verbose = verbose) 
+                                  output_device_keywords = output_device_keywords, verbose = verbose,
+                                  decode_workers = args.decode_workers, metrics_file = args.metrics_file, passes = args.passes,
+                                  spectrum_shm = args.spectrum_shm, archive = args.archive,
+                                  record = args.record) 
+        if(control_server):
+            control_server.cycle_manager = cycle_manager
         print("PyFT8 Rx running — Ctrl-C to stop")
         try:
             while True:
                 time.sleep(1)
         except KeyboardInterrupt:
             print("\nStopping PyFT8 Rx")
+    if(control_server):
+        control_server.close()
+    if(decode_log):
+        decode_log.close()
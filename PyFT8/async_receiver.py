@@ -0,0 +1,171 @@
+"""
+asyncio front end. The receiver's own threads hand each decode and cycle summary to the event loop once, and from
+there they are broadcast to any number of async subscribers without further threads or copies:
+
+    async with AsyncReceiver(FT8, input_device_keywords = ['USB']) as receiver:
+        async for decode in receiver.decodes():
+            ...
+
+Each stream is a bounded window of recent items that every subscriber reads at its own pace. A subscriber that
+falls more than maxlen items behind skips the oldest ones, counted in its stream's dropped, rather than holding
+up the receiver or the other subscribers.
+
+Leaving the async context (or close()) stops the receiver's threads and input and shuts down its decode pool. If
+a receiver fails, the streams end by raising its exception.
+"""
+
+import asyncio
+import threading
+from collections import deque
+from PyFT8.metrics import global_metrics
+from PyFT8.time_utils import global_time_utils
+
+class Broadcast:
+    def __init__(self, maxlen = 1000, name = 'broadcast'):
+        """Use only from the event loop's thread."""
+        self.items = deque(maxlen = maxlen)
+        self.name = name
+        self.published = 0
+        self.dropped = 0
+        self.closed = False
+        self.error = None
+        self.waiter = None
+
+    def publish(self, item):
+        self.items.append(item)
+        self.published += 1
+        self._wake()
+
+    def close(self, error = None):
+        """End the subscribers' iterators, once they have read what is in the window, by raising error if given."""
+        if not self.closed:
+            self.closed = True
+            self.error = error
+        self._wake()
+
+    def _wake(self):
+        waiter, self.waiter = self.waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def subscribe(self, history = False):
+        """Async iterator over the items published from now on (or, with history, all those still in the window),
+        ending when the broadcast is closed."""
+        return self._iterate(self.published - len(self.items) if history else self.published)
+
+    async def _iterate(self, seen):
+        while True:
+            while seen == self.published and not self.closed:
+                if self.waiter is None:
+                    self.waiter = asyncio.get_running_loop().create_future()
+                # shielded, so that cancelling one subscriber doesn't cancel the future the others wait on
+                await asyncio.shield(self.waiter)
+            if seen == self.published:
+                if self.error is not None:
+                    raise self.error
+                return
+            first = self.published - len(self.items)
+            if seen < first:
+                self.dropped += first - seen
+                global_metrics.count(self.name + '_dropped', first - seen)
+                seen = first
+            item = self.items[seen - first]
+            seen += 1
+            yield item
+
+class AsyncReceiver:
+    def __init__(self, sigspec, receivers = None, maxlen = 1000, **kwargs):
+        """A Cycle_manager with the given arguments, or a MultiReceiver if a list of receivers is given.
+        Nothing starts until start() (or entering the async context)."""
+        self.sigspec = sigspec
+        self.receivers = receivers
+        self.kwargs = kwargs
+        self.decode_stream = Broadcast(maxlen, 'async_decodes')
+        self.cycle_stream = Broadcast(maxlen, 'async_cycles')
+        self.managers = []
+        self.owner = None       # the Cycle_manager or MultiReceiver, closed when the last manager thread ends
+        self.threads = []
+        self.running = 0
+        self.lock = threading.Lock()
+        self.error = None
+        self.loop = None
+
+    async def start(self):
+        """Open the inputs, wait for the cycle rollover and start decoding."""
+        self.loop = asyncio.get_running_loop()
+        on_decode = lambda dd: self._call_soon(self.decode_stream.publish, dd)
+        on_finished = lambda summary: self._call_soon(self._cycle_finished, summary)
+        # Opening the inputs blocks until the rollover for live audio, so it runs in the default executor
+        if self.receivers is None:
+            from PyFT8.cycle_manager import Cycle_manager
+            make = lambda: Cycle_manager(self.sigspec, on_decode, run = False, on_finished = on_finished, **self.kwargs)
+        else:
+            from PyFT8.multi_receiver import MultiReceiver
+            make = lambda: MultiReceiver(self.sigspec, on_decode, self.receivers, run = False, on_finished = on_finished, **self.kwargs)
+        self.owner = await self.loop.run_in_executor(None, make)
+        self.managers = getattr(self.owner, 'managers', [self.owner])
+        self.running = len(self.managers)
+        self.threads = [threading.Thread(target = self._manage_cycle, args = (manager,), daemon = True) for manager in self.managers]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def _call_soon(self, callback, *args):
+        # The receiver's threads can outlive the event loop, if it is closed without leaving the async context
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            pass
+
+    def _manage_cycle(self, manager):
+        error = None
+        try:
+            manager.manage_cycle()
+        except Exception as e:
+            error = e
+            global_time_utils.tlog(f"[AsyncReceiver] receiver {manager.receiver} failed: {e!r}")
+        finally:
+            with self.lock:
+                self.running -= 1
+                last = not self.running
+            if last:
+                self.owner.close()
+            self._call_soon(self._manager_finished, error)
+
+    def _cycle_finished(self, summary):
+        summary['metrics'] = global_metrics.snapshot()['last_cycle']
+        self.cycle_stream.publish(summary)
+
+    def _manager_finished(self, error):
+        if error is not None and self.error is None:
+            self.error = error
+            self.close()
+        elif not self.running:
+            self.close()
+
+    def decodes(self, history = False):
+        """Async iterator over decode dicts, ending when the input (e.g. a wav file) finishes or on close()."""
+        return self.decode_stream.subscribe(history)
+
+    def cycles(self, history = False):
+        """Async iterator over per-cycle summaries: the on_finished dict plus the last cycle's metrics."""
+        return self.cycle_stream.subscribe(history)
+
+    def close(self):
+        """Stop the receivers and end every subscriber's stream (raising the first receiver error, if any). The
+        decode pool is shut down as soon as the manager threads have returned; wait_closed() waits for that."""
+        for manager in self.managers:
+            manager.stop()
+        self.decode_stream.close(self.error)
+        self.cycle_stream.close(self.error)
+
+    async def wait_closed(self):
+        for thread in self.threads:
+            await self.loop.run_in_executor(None, thread.join)
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        self.close()
+        await self.wait_closed()
@@ -1,8 +1,15 @@
 import numpy as np
 import wave
-import pyaudio
+try:
+    import pyaudio
+except ImportError:     # only needed for sound card input and output
+    pyaudio = None
 import time
+import math
+import threading
+from functools import lru_cache
 from PyFT8.FT8_encoder import pack_message
+from PyFT8.metrics import global_metrics
 
 def find_device(device_str_contains):
     if(not device_str_contains): #(this check probably shouldn't be needed - check calling code)
@@ -19,74 +26,278 @@ def find_device(device_str_contains):
     print(f"[Audio] No audio device found matching {device_str_contains}")
 
 class AudioIn:
-    def __init__(self, cycle_seconds, hops_percycle, symbol_rate, hops_persymb, fbins_pertone, max_freq):
+    def __init__(self, cycle_seconds, hops_percycle, symbol_rate, hops_persymb, fbins_pertone, max_freq, ring_hops = 64):
         self.sample_rate = 12000
         self.samples_perhop = int(self.sample_rate / (symbol_rate * hops_persymb))
         self.fft_len = int(fbins_pertone * self.sample_rate // symbol_rate)
         fft_out_len = int(self.fft_len/2) + 1
         self.nFreqs = int(fft_out_len * max_freq * 2 / self.sample_rate)
         self.fft_window = fft_window=np.hanning(self.fft_len)
-        self.audio_buffer = np.zeros(self.fft_len, dtype=np.float32)
         self.hops_percycle = hops_percycle
         self.wav_finished = False
         self.dB_main = np.zeros((self.hops_percycle, self.nFreqs), dtype = np.float32)
         self.main_ptr = 0
+        # Sample ring written by _callback and read by the STFT stage. It is stored twice over (ring_len
+        # samples, then the same again) so that any run of up to ring_len samples is contiguous.
+        self.ring_len = self.fft_len + ring_hops * self.samples_perhop
+        self.ring = np.zeros(2 * self.ring_len, dtype=np.int16)
+        self.samples_in = 0
+        self.hops_done = 0
+        self.overflow_hops = 0
+        self.late_hops = 0
+        self.hop_event = threading.Event()
+        self.hops_ready = threading.Condition()
+        self.spectrum_ring = None
+        self.recorder = None
+        self.channel, self.channels = 0, 1
+        self.stream = None
+        self.input_thread = None    # the thread writing dB_main: wav playback, or the STFT stage for live input
+        self.closed = False
 
-    def do_fft(self):
-        z = np.fft.rfft(self.audio_buffer * self.fft_window)
+    def enable_spectrum_ring(self, df, nslots = 512, shm_name = None):
+        """Publish every new dB_main row to a SpectrumRing for lock-free viewers (in shared memory if shm_name is given)."""
+        from PyFT8.spectrum_ring import SpectrumRing
+        if self.spectrum_ring is None:
+            self.spectrum_ring = SpectrumRing(nslots, self.nFreqs, shm_name, df)
+        return self.spectrum_ring
+
+    def enable_recorder(self, path, cycle_seconds = 15, max_files = None):
+        """Hand every incoming audio buffer to a CycleRecorder writing per-cycle wav files in path."""
+        from PyFT8.recorder import CycleRecorder
+        if self.recorder is None:
+            self.recorder = CycleRecorder(path, self.sample_rate, cycle_seconds, max_files = max_files)
+        return self.recorder
+
+    def _spectra(self, frames):
+        z = np.fft.rfft(frames * self.fft_window, axis=1)[:, :self.nFreqs]
         p = z.real*z.real + z.imag*z.imag
-        self.dB_main[self.main_ptr] = 10*np.log10(p[:self.nFreqs]+1e-12)
-        self.main_ptr = (self.main_ptr + 1) % self.hops_percycle
+        return 10*np.log10(p+1e-12)
+
+    def stft(self, samples):
+        # Row k is the spectrum of the fft_len samples ending at sample (k+1)*samples_perhop, as produced
+        # by the STFT stage from the start of a stream
+        padded = np.concatenate((np.zeros(self.fft_len - self.samples_perhop, dtype=np.float32), samples))
+        return self._spectra(np.lib.stride_tricks.sliding_window_view(padded, self.fft_len)[::self.samples_perhop])
+
+    def process_pending(self):
+        """Window and FFT all complete hops waiting in the ring in one go, writing them to dB_main.
+        Hops that have already been overwritten in the ring are skipped and counted in overflow_hops;
+        hops found waiting behind another one are counted in late_hops."""
+        t0 = time.perf_counter()
+        hop = self.samples_perhop
+        pending = self.samples_in // hop - self.hops_done
+        max_pending = (self.ring_len - self.fft_len) // hop - 2
+        if pending > max_pending:
+            skipped = pending - max_pending
+            self.overflow_hops += skipped
+            global_metrics.count('overflow_hops', skipped)
+            self.hops_done += skipped
+            self.main_ptr = (self.main_ptr + skipped) % self.hops_percycle
+            pending = max_pending
+        if pending <= 0:
+            return 0
+        self.late_hops += pending - 1
+        global_metrics.count('late_hops', pending - 1)
+        start = (self.hops_done + 1) * hop - self.fft_len
+        block = self.ring[start % self.ring_len:][:self.fft_len + (pending - 1) * hop]
+        dB = self._spectra(np.lib.stride_tricks.sliding_window_view(block, self.fft_len)[::hop])
+        rows = (self.main_ptr + np.arange(pending)) % self.hops_percycle
+        self.dB_main[rows] = dB
+        if self.spectrum_ring is not None:
+            self.spectrum_ring.publish(dB)
+        self.hops_done += pending
+        self.main_ptr = (self.main_ptr + pending) % self.hops_percycle
+        global_metrics.count('hops', pending)
+        global_metrics.observe('stft_hop', (time.perf_counter() - t0) / pending, pending)    # pending hops, timed as one batch
+        with self.hops_ready:
+            self.hops_ready.notify_all()
+        return pending
+
+    def wait_for_hops(self, hops_seen, timeout = None):
+        """Block until dB_main has rows beyond hops_seen (a previous return value), or timeout. Returns hops_done."""
+        with self.hops_ready:
+            self.hops_ready.wait_for(lambda: self.hops_done != hops_seen, timeout)
+            return self.hops_done
 
-    def load_wav(self, wav_path, hop_dt=0):
+    def run_stft(self):
+        while not self.closed:
+            self.hop_event.wait(0.1)
+            self.hop_event.clear()
+            self.process_pending()
+
+    def load_wav_offline(self, wav_path):
+        """Fill dB_main from a whole wav file at once, with hop 0 at the start of the file."""
         wf = wave.open(wav_path, "rb")
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        wf.close()
+        self.load_samples(samples)
+
+    def load_samples(self, samples):
+        """Fill dB_main from one cycle of int16 samples at once, with hop 0 at the first sample."""
+        samples = np.asarray(samples).astype(np.float32)
+        dB = self.stft(samples[:self.hops_percycle * self.samples_perhop])
+        self.dB_main[:len(dB)] = dB
+        self.dB_main[len(dB):] = 0
+        self.main_ptr = len(dB) % self.hops_percycle
+        self.wav_finished = True
+
+    def load_wav(self, wav_path, hop_dt=0, channel=0):
+        wf = wave.open(wav_path, "rb")
+        self.channel, self.channels = channel, wf.getnchannels()
         frames = wf.readframes(self.samples_perhop)
         th = time.time()
-        while frames:
+        while frames and not self.closed:
             if(hop_dt>0):
                 delay = hop_dt - (time.time()-th)
                 if(delay>0):
                     time.sleep(delay)
             self._callback(frames, None, None, None)
+            self.process_pending()
             frames = wf.readframes(self.samples_perhop)
             th = time.time()
         wf.close()
         self.wav_finished = True
 
-    def start_live(self, input_device_idx):
-        self.stream = pyaudio.PyAudio().open(
-            format = pyaudio.paInt16, channels=1, rate = self.sample_rate,
-            input = True, input_device_index = input_device_idx,
-            frames_per_buffer = self.samples_perhop, stream_callback=self._callback,)
-        self.stream.start_stream()
+    def close(self):
+        """Stop the input (the live stream, which may be shared with other channels, or the wav playback),
+        write out the recorder and close the spectrum ring. Returns once nothing more will be written to dB_main."""
+        self.closed = True
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            try:
+                stream.stop_stream()
+                stream.close()
+            except OSError:
+                pass    # already closed for another channel of the same stream
+        thread = self.input_thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if self.spectrum_ring is not None:
+            self.spectrum_ring.close()
+            self.spectrum_ring = None
+        with self.hops_ready:
+            self.hops_ready.notify_all()
+
+    def start_live(self, input_device_idx, channel=0):
+        start_live_channels({channel: self}, input_device_idx)
 
     def _callback(self, in_data, frame_count, time_info, status_flags):
-        samples = np.frombuffer(in_data, dtype=np.int16).astype(np.float32)
+        samples = np.frombuffer(in_data, dtype=np.int16)
+        recorder = self.recorder
+        if self.channels > 1:
+            samples = samples[self.channel::self.channels]
+            in_data = samples.tobytes() if recorder is not None else None
         ns = len(samples)
-        self.audio_buffer[:-ns] = self.audio_buffer[ns:]
-        self.audio_buffer[-ns:] = samples
-        self.do_fft()
+        pos = self.samples_in % self.ring_len
+        first = min(ns, self.ring_len - pos)
+        for offset in (0, self.ring_len):
+            self.ring[offset + pos:offset + pos + first] = samples[:first]
+            self.ring[offset:offset + ns - first] = samples[first:]
+        self.samples_in += ns
+        if recorder is not None:
+            recorder.submit(in_data)
+        self.hop_event.set()
         return (None, pyaudio.paContinue)
 
+def start_live_channels(audio_ins, input_device_idx):
+    """Open one input stream on a device and feed each of its channels to an AudioIn, given as {channel: AudioIn}
+    (e.g. the left and right channels of one interface to two receivers)."""
+    channels = max(audio_ins) + 1
+    for channel, audio_in in audio_ins.items():
+        audio_in.channel, audio_in.channels = channel, channels
+        audio_in.input_thread = threading.Thread(target=audio_in.run_stft, daemon=True)
+        audio_in.input_thread.start()
+    def callback(in_data, frame_count, time_info, status_flags):
+        for audio_in in audio_ins.values():
+            audio_in._callback(in_data, frame_count, time_info, status_flags)
+        return (None, pyaudio.paContinue)
+    any_in = next(iter(audio_ins.values()))
+    stream = pyaudio.PyAudio().open(
+        format = pyaudio.paInt16, channels=channels, rate = any_in.sample_rate,
+        input = True, input_device_index = input_device_idx,
+        frames_per_buffer = any_in.samples_perhop, stream_callback=callback,)
+    for audio_in in audio_ins.values():
+        audio_in.stream = stream
+    stream.start_stream()
+    return stream
+
+@lru_cache(maxsize = 8)
+def gfsk_pulse(symbol_len, bt = 2.0):
+    """FT8's Gaussian frequency pulse (as WSJT-X gen_ft8wave), spanning three symbols and returned
+    as a (3, symbol_len) array: its contribution to the previous, own and next symbol's slots."""
+    k = math.pi * math.sqrt(2 / math.log(2)) * bt
+    t = (np.arange(3 * symbol_len) - 1.5 * symbol_len) / symbol_len
+    erf = np.vectorize(math.erf)
+    pulse = 0.5 * (erf(k * (t + 0.5)) - erf(k * (t - 0.5)))
+    pulse.setflags(write = False)
+    return pulse.reshape(3, symbol_len)
+
+@lru_cache(maxsize = 8)
+def gfsk_tone_tables(symbol_len, fs, f_step, ntones = 8):
+    """Phase tables for every (previous, current, next) tone triple: the phase advance within a symbol slot
+    before each sample, shape (ntones**3, symbol_len), and over the whole slot, shape (ntones**3,)."""
+    pulse = gfsk_pulse(symbol_len)
+    prev, cur, nxt = np.indices((ntones,) * 3).reshape(3, -1, 1)
+    dphi = 2 * np.pi * f_step / fs * (nxt * pulse[0] + cur * pulse[1] + prev * pulse[2])
+    phase_within = np.cumsum(dphi, axis = 1) - dphi
+    phase_total = np.sum(dphi, axis = 1)
+    phase_within.setflags(write = False)
+    phase_total.setflags(write = False)
+    return phase_within, phase_total
+
+@lru_cache(maxsize = 8)
+def edge_ramp(symbol_len):
+    n = symbol_len // 8
+    ramp = (1 - np.cos(np.pi * np.arange(n) / n)) / 2
+    ramp.setflags(write = False)
+    return ramp
+
 class AudioOut:
 
     def create_ft8_symbols(self, tx_msg):
         c1, c2, grid_rpt = tx_msg.split()
         return pack_message(c1, c2, grid_rpt)
 
+    def create_ft8_waves(self, symbols, f_bases, fs=12000, f_step=6.25, symbol_seconds = 0.160):
+        """GFSK waveforms for an (N, nsym) array of symbols at N base frequencies, as (N, nsym * symbol_len)
+        floats with unit amplitude. The frequency trajectory is the symbol sequence (with its first and last tone
+        repeated either side) convolved with the Gaussian pulse, so each symbol's phase comes from a cached table
+        for its tone triple, offset by the phase accumulated over the symbols before it."""
+        symbols = np.atleast_2d(np.asarray(symbols, dtype = int))
+        f_bases = np.broadcast_to(np.asarray(f_bases, dtype = np.float64), (len(symbols),))
+        nmsgs, nsym = symbols.shape
+        symbol_len = int(fs * symbol_seconds)
+        phase_within, phase_total = gfsk_tone_tables(symbol_len, fs, f_step)
+        tones = np.hstack((symbols[:, :1], symbols, symbols[:, -1:]))
+        triples = (tones[:, :-2] * 8 + tones[:, 1:-1]) * 8 + tones[:, 2:]
+        symbol_phase = np.cumsum(phase_total[triples], axis = 1) - phase_total[triples]
+        phase = (symbol_phase[:, :, None] + phase_within[triples]).reshape(nmsgs, -1)
+        phase += (2 * np.pi / fs * f_bases[:, None]) * np.arange(nsym * symbol_len)
+        waves = np.sin(phase)
+        ramp = edge_ramp(symbol_len)
+        waves[:, :len(ramp)] *= ramp
+        waves[:, -len(ramp):] *= 1 - ramp
+        return waves
+
+    def mix_ft8_waves(self, symbols, f_bases, start_samples, amplitudes, n_samples, fs=12000, chunk = 16):
+        """Mix many messages into one float buffer of n_samples: message i (a row of symbols) at f_bases[i] Hz,
+        starting at start_samples[i] (which may be negative or run past the end) and scaled by amplitudes[i]."""
+        buffer = np.zeros(n_samples)
+        symbols = np.atleast_2d(symbols)
+        for c in range(0, len(symbols), chunk):
+            waves = self.create_ft8_waves(symbols[c:c + chunk], np.asarray(f_bases)[c:c + chunk], fs)
+            for wave, start, amplitude in zip(waves, start_samples[c:c + chunk], amplitudes[c:c + chunk]):
+                start = int(start)
+                lo, hi = max(start, 0), min(start + wave.shape[0], n_samples)
+                if hi > lo:
+                    buffer[lo:hi] += amplitude * wave[lo - start:hi - start]
+        return buffer
+
     def create_ft8_wave(self, symbols, fs=12000, f_base=873.0, f_step=6.25, amplitude = 0.5):
-        symbol_len = int(fs * 0.160)
-        t = np.arange(symbol_len) / fs
-        phase = 0
-        waveform = []
-        for s in symbols:
-            f = f_base + s * f_step
-            phase_inc = 2 * np.pi * f / fs
-            w = np.sin(phase + phase_inc * np.arange(symbol_len))
-            waveform.append(w)
-            phase = (phase + phase_inc * symbol_len) % (2 * np.pi)
-        waveform = np.concatenate(waveform).astype(np.float32)
-        waveform = waveform.astype(np.float32)
+        waveform = self.create_ft8_waves([symbols], [f_base], fs, f_step)[0]
         waveform = amplitude * waveform / np.max(np.abs(waveform))
         waveform_int16 = np.int16(waveform * 32767)
         return waveform_int16
@@ -99,11 +310,15 @@ class AudioOut:
         wavefile.writeframes(audio_data.tobytes())
         wavefile.close()
 
-    def play_data_to_soundcard(self, audio_data_int16, output_device_idx, fs=12000):
+    def play_data_to_soundcard(self, audio_data_int16, output_device_idx, fs=12000, stop = None):
+        """Play int16 audio, in 0.1 s pieces so that setting the threading.Event stop cuts it short."""
         stream = pyaudio.PyAudio().open(format=pyaudio.paInt16, channels=1, rate=fs,
                           output=True,
                           output_device_index = output_device_idx)
-        stream.write(audio_data_int16.tobytes())
+        for i in range(0, len(audio_data_int16), fs // 10):
+            if stop is not None and stop.is_set():
+                break
+            stream.write(audio_data_int16[i:i + fs // 10].tobytes())
         stream.stop_stream()
         stream.close()
 
@@ -0,0 +1,122 @@
+"""
+Synthetic throughput and sensitivity benchmark.
+
+Builds 15 s cycles containing N FT8 signals at chosen frequencies, dt offsets and SNRs in calibrated
+white Gaussian noise, decodes them with the offline decoder and writes a JSON summary:
+
+    python -m PyFT8.benchmark --cycles 20 --signals 10 --snr -24 -6 -o bench.json
+"""
+
+import argparse
+import json
+import random
+import time
+import numpy as np
+from string import ascii_uppercase as ltrs
+from PyFT8.FT8_encoder import pack_messages
+from PyFT8.audio import AudioOut
+from PyFT8.offline import decode_samples
+
+SAMPLE_RATE = 12000
+CYCLE_SAMPLES = 15 * SAMPLE_RATE
+NOISE_RMS = 1000.0           # noise level in int16 units, leaving headroom for strong signals
+SNR_BANDWIDTH = 2500.0       # SNRs are quoted in a 2500 Hz bandwidth, as WSJT-X
+
+def random_call(rng):
+    prefix = rng.choice(['K', 'W', 'N', 'G', 'M', 'F', 'DL', 'EA', 'JA', 'VK', 'PY', 'ZL'])
+    return prefix + str(rng.randrange(10)) + ''.join(rng.choice(ltrs) for _ in range(rng.randrange(2, 4)))
+
+def random_message(rng):
+    grid = rng.choice(ltrs[:18]) + rng.choice(ltrs[:18]) + str(rng.randrange(10)) + str(rng.randrange(10))
+    report = rng.choice([grid, grid, f"{rng.randrange(-24, 10):+03d}", 'RR73', '73', 'RRR'])
+    return (rng.choice(['CQ', random_call(rng)]), random_call(rng), report)
+
+def random_signals(rng, nsignals, snrs, freq_range, min_spacing = 60, max_tries = 1000):
+    """Choose nsignals non-overlapping signals with random messages, frequencies, dt and SNR drawn from snrs.
+    Raises ValueError if they can't be fitted into freq_range min_spacing apart (within max_tries draws each)."""
+    freqs = []
+    for _ in range(max_tries * nsignals):
+        if len(freqs) == nsignals:
+            break
+        f = rng.uniform(freq_range[0], freq_range[1] - 50)
+        if all(abs(f - f2) >= min_spacing for f2 in freqs):
+            freqs.append(f)
+    if len(freqs) < nsignals:
+        raise ValueError(f"can't fit {nsignals} signals {min_spacing} Hz apart between {freq_range[0]} and {freq_range[1]} Hz")
+    return [{'msg': random_message(rng), 'f': round(f, 1), 'dt': round(rng.uniform(-0.5, 1.5), 2),
+             'snr': rng.choice(snrs)} for f in freqs]
+
+def synthesize_cycle(signals, np_rng, noise_rms = NOISE_RMS):
+    """Mix signals (dicts with msg, f, dt, snr) into one cycle of white noise. Returns int16 samples."""
+    symbols, valid = pack_messages([s['msg'] for s in signals])
+    signals = [s for s, ok in zip(signals, valid) if ok]
+    noise_power = noise_rms**2 * SNR_BANDWIDTH / (SAMPLE_RATE / 2)
+    audio = np_rng.normal(0, noise_rms, CYCLE_SAMPLES)
+    audio += AudioOut().mix_ft8_waves(symbols[valid], [s['f'] for s in signals],
+                                      [int((0.5 + s['dt']) * SAMPLE_RATE) for s in signals],
+                                      [np.sqrt(2 * noise_power * 10**(s['snr'] / 10)) for s in signals], CYCLE_SAMPLES)
+    return np.clip(audio, -32767, 32767).astype(np.int16)
+
+def run_benchmark(cycles, nsignals, snrs, seed = 0, freq_range = [200, 3100], passes = 1, min_spacing = 60):
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    per_snr = {snr: {'sent': 0, 'decoded': 0} for snr in snrs}
+    per_cycle = []
+    for cycle in range(cycles):
+        signals = random_signals(rng, nsignals, snrs, freq_range, min_spacing)
+        samples = synthesize_cycle(signals, np_rng)
+        # synthesize_cycle leaves out messages that can't be packed, so they don't count as sent
+        signals = [s for s, ok in zip(signals, pack_messages([s['msg'] for s in signals])[1]) if ok]
+        t_wall, t_cpu = time.perf_counter(), time.process_time()
+        decodes = decode_samples(samples, f"synthetic_{cycle:04d}", freq_range = freq_range, passes = passes)
+        t_wall, t_cpu = time.perf_counter() - t_wall, time.process_time() - t_cpu
+        decoded_msgs = {dd['msg'] for dd in decodes}
+        sent_msgs = set()
+        for s in signals:
+            msg = ' '.join(s['msg'])
+            sent_msgs.add(msg)
+            per_snr[s['snr']]['sent'] += 1
+            per_snr[s['snr']]['decoded'] += msg in decoded_msgs
+        per_cycle.append({'decodes': len(decoded_msgs & sent_msgs), 'false_decodes': len(decoded_msgs - sent_msgs),
+                          'cpu_s': round(t_cpu, 4), 'wall_s': round(t_wall, 4)})
+    cpu = np.array([c['cpu_s'] for c in per_cycle])
+    return {
+        'config': {'cycles': cycles, 'signals_per_cycle': nsignals, 'snrs': list(snrs), 'seed': seed,
+                   'freq_range': list(freq_range), 'noise_rms': NOISE_RMS, 'passes': passes, 'min_spacing': min_spacing},
+        'decodes_per_cycle': float(np.mean([c['decodes'] for c in per_cycle])),
+        'false_decodes_per_cycle': float(np.mean([c['false_decodes'] for c in per_cycle])),
+        'cpu_s_per_cycle': {'mean': float(np.mean(cpu)), 'median': float(np.median(cpu)), 'max': float(np.max(cpu))},
+        'decode_rate_vs_snr': {str(snr): {**v, 'rate': v['decoded'] / v['sent'] if v['sent'] else None}
+                               for snr, v in per_snr.items()},
+        'cycles': per_cycle,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(prog='PyFT8bench', description = 'Synthetic FT8 decoder throughput and sensitivity benchmark')
+    parser.add_argument('--cycles', type = int, default = 10, help = 'Number of 15 s cycles to synthesize')
+    parser.add_argument('--signals', type = int, default = 10, help = 'Signals per cycle')
+    parser.add_argument('--snr', type = int, nargs = 2, default = [-24, -6], metavar = ('MIN', 'MAX'), help = 'SNR range in dB (2500 Hz bandwidth)')
+    parser.add_argument('--snr_step', type = int, default = 2, help = 'SNR step in dB')
+    parser.add_argument('--seed', type = int, default = 0, help = 'Random seed, for repeatable runs')
+    parser.add_argument('--fmin', type = int, default = 200, help = 'Minimum frequency (Hz)')
+    parser.add_argument('--fmax', type = int, default = 3100, help = 'Maximum frequency (Hz)')
+    parser.add_argument('--passes', type = int, default = 1, help = 'Decode passes, subtracting decoded signals between passes')
+    parser.add_argument('--min_spacing', type = float, default = 60, help = 'Minimum spacing between signals (Hz); below 50 signals overlap')
+    parser.add_argument('-o', '--output', help = 'Write the JSON results to this file (default: stdout)')
+    args = parser.parse_args()
+
+    snrs = list(range(args.snr[0], args.snr[1] + 1, args.snr_step))
+    try:
+        results = run_benchmark(args.cycles, args.signals, snrs, args.seed, [args.fmin, args.fmax], args.passes, args.min_spacing)
+    except ValueError as e:
+        parser.error(str(e))
+    text = json.dumps(results, indent = 2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+        print(f"{results['decodes_per_cycle']:.1f} decodes per cycle, {results['cpu_s_per_cycle']['mean']:.3f} s CPU per cycle -> {args.output}")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
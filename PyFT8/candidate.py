@@ -2,83 +2,146 @@
 import numpy as np
 import time
 from PyFT8.FT8_unpack import unpack
-from PyFT8.FT8_crc import check_crc
+from PyFT8.FT8_crc import check_crc_batch
 from PyFT8.ldpc import LdpcDecoder
+from PyFT8.osd import osd_decode
+from PyFT8.metrics import global_metrics
 
 params = {
 'MIN_LLR_SD': 0.5,           # global minimum llr_sd
 'LDPC_CONTROL': (45, 12),         # max ncheck0, max iterations         
+'OSD_MAX_NCHECK': 25,        # failed candidates ending BP with at most this many unsatisfied checks get OSD
+'OSD_ORDER': 2,              # bits flipped in the most reliable basis (-1 disables OSD)
+'OSD_BUDGET': 0.5,           # OSD seconds allowed per CandidateTable (i.e. per cycle)
 }
 
-class Candidate:
-    def __init__(self):
+batch_ldpc = LdpcDecoder()
 
-        self.demap_started, self.decode_completed = False, False
-        self.ncheck0, self.ncheck = 99, 99
-        self.llr_sd = 0
-        self.decode_path = ''
-        self.decode_dict = False
-        self.processing_time = 0
-        self.cyclestart_str = ''
-        self.msg = ''
-        # decode_dict is set in spectrum search
-        self.ldpc = LdpcDecoder()
+class CandidateTable:
+    """Struct-of-arrays store for one search's candidates: one row per candidate, with decode
+    dicts built only for rows that decode."""
+    SEARCHED, DEMAPPED, DECODED, FAILED = 0, 1, 2, 3
 
-    def _record_state(self, actor_code, final = False):
-        finalcode = "#" if final else ""
-        self.decode_path = self.decode_path + f"{actor_code}{self.ncheck:02d}{finalcode}"
-        if(final):
-            self.decode_completed = time.time()
+    def __init__(self, spectrum, f0_idx, h0_idx, score, cyclestart_str, sync_idx = 1):
+        n = len(f0_idx)
+        self.spectrum = spectrum
+        self.cyclestart_str = cyclestart_str
+        self.sync_idx = sync_idx
+        self.f0_idx = np.asarray(f0_idx, dtype=np.int32)
+        self.h0_idx = np.asarray(h0_idx, dtype=np.int32)
+        self.score = np.asarray(score, dtype=np.float32)
+        self.last_payload_hop = self.h0_idx + spectrum.hops_persymb * 72
+        self.llr_sd = np.zeros(n)
+        self.snr = np.full(n, -30, dtype=np.int8)
+        self.ncheck0 = np.full(n, 99, dtype=np.int16)
+        self.ncheck = np.full(n, 99, dtype=np.int16)
+        self.state = np.full(n, self.SEARCHED, dtype=np.int8)
+        self.llr = np.zeros((n, 174), dtype=np.float32)
+        self.decodes = {}   # row -> (msg tuple, decode_path, decode time, bits77_int)
+        self.cycle_start_time = None
+        self.osd_budget = params['OSD_BUDGET']
 
-    def demap(self, spectrum, target_params = (3.3, 3.7)):
-        self.demap_started = time.time()
-        hops = np.clip(self.sync['h0_idx'] + spectrum.base_payload_hops, 0, spectrum.hops_percycle - 1)
-        self.dB = spectrum.audio_in.dB_main[np.ix_(hops, self.freq_idxs)]
-        p = np.clip(self.dB - np.max(self.dB), -80, 0)
-        llra = np.max(p[:, [4,5,6,7]], axis=1) - np.max(p[:, [0,1,2,3]], axis=1)
-        llrb = np.max(p[:, [2,3,4,7]], axis=1) - np.max(p[:, [0,1,5,6]], axis=1)
-        llrc = np.max(p[:, [1,2,6,7]], axis=1) - np.max(p[:, [0,3,4,5]], axis=1)
-        llr = np.column_stack((llra, llrb, llrc))
-        llr = llr.ravel() / 10
-        self.llr_sd = int(0.5+100*np.std(llr))/100.0
-        llr = target_params[0] * llr / (1e-12 + self.llr_sd)
-        self.llr = np.clip(llr, -target_params[1], target_params[1])
-        self.decode_dict.update({'llr_sd':self.llr_sd})
-          
-    def decode(self):
-        decode_started = time.time()
-        if(self.llr_sd < params['MIN_LLR_SD']):
-            self._record_state("I", final = True)
-            return
-        self.ncheck = self.ldpc.calc_ncheck(self.llr)
-        self.ncheck0 = self.ncheck
-        self._record_state("I")
+    def __len__(self):
+        return len(self.f0_idx)
 
-        if self.ncheck > 0:
-            if self.ncheck <= params['LDPC_CONTROL'][0]:
-                for it in range(params['LDPC_CONTROL'][1]):
-                    self.llr, self.ncheck = self.ldpc.do_ldpc_iteration(self.llr)
-                    self._record_state("L")
-                    if(self.ncheck == 0):
-                        break                    
-        if(self.ncheck == 0):
-            bits91_int = 0
-            for bit in (self.llr[:91] > 0).astype(int).tolist():
-                bits91_int = (bits91_int << 1) | bit
-            bits77_int = check_crc(bits91_int)
-            if(bits77_int):
-                self.msg = unpack(bits77_int)
+    def demap(self, rows, target_params = (3.3, 3.7)):
+        """Demap the given rows, all at once."""
+        t0 = time.perf_counter()
+        rows = np.asarray(rows, dtype=int)
+        if not len(rows):
+            return
+        spectrum = self.spectrum
+        hops = np.clip(self.h0_idx[rows, None] + spectrum.base_payload_hops[None, :], 0, spectrum.hops_percycle - 1)
+        freqs = self.f0_idx[rows, None] + np.array(spectrum.tone_freq_idxs(0))[None, :]
+        dB = spectrum.audio_in.dB_main[hops[:, :, None], freqs[:, None, :]]
+        dB_max, dB_min = np.max(dB, axis=(1, 2)), np.min(dB, axis=(1, 2))
+        p = np.clip(dB - dB_max[:, None, None], -80, 0)
+        llra = np.max(p[:, :, [4,5,6,7]], axis=2) - np.max(p[:, :, [0,1,2,3]], axis=2)
+        llrb = np.max(p[:, :, [2,3,4,7]], axis=2) - np.max(p[:, :, [0,1,5,6]], axis=2)
+        llrc = np.max(p[:, :, [1,2,6,7]], axis=2) - np.max(p[:, :, [0,3,4,5]], axis=2)
+        llr = np.stack((llra, llrb, llrc), axis=2).reshape(len(hops), -1) / 10
+        llr_sd = (0.5 + 100 * np.std(llr, axis=1)).astype(int) / 100.0
+        llr = target_params[0] * llr / (1e-12 + llr_sd[:, None])
+        self.llr[rows] = np.clip(llr, -target_params[1], target_params[1])
+        self.llr_sd[rows] = llr_sd
+        self.snr[rows] = np.clip((dB_max - dB_min - 58).astype(int), -24, 24)
+        self.state[rows] = self.DEMAPPED
+        global_metrics.observe('demap', time.perf_counter() - t0)
 
-        self._record_state("M" if self.msg else "_", final = True)
+    def decode(self, rows, deadline = None):
+        """Batch decode the given (demapped) rows, with no OSD after deadline (a time.time() value) if given.
+        Returns the rows that produced a message."""
+        rows = np.asarray(rows)
+        low_sd = self.llr_sd[rows] < params['MIN_LLR_SD']
+        self.state[rows[low_sd]] = self.FAILED
+        rows = rows[~low_sd]
+        if not len(rows):
+            return rows
+        bits, ncheck, ncheck_hist = batch_ldpc.decode_batch(self.llr[rows], params['LDPC_CONTROL'][1], params['LDPC_CONTROL'][0])
+        self.ncheck0[rows] = ncheck_hist[:, 0]
+        self.ncheck[rows] = ncheck
+        self.state[rows] = self.FAILED
+        converged = np.flatnonzero(ncheck == 0)
+        with global_metrics.timer('crc'):
+            crc_ok = converged[check_crc_batch(bits[converged, :91])]
+        decoded = []
+        for i in crc_ok:
+            bits77_int = int.from_bytes(np.packbits(bits[i, :77]).tobytes(), 'big') >> 3
+            hist = ncheck_hist[i][ncheck_hist[i] >= 0]
+            decode_path = ''.join(f"{'L' if it else 'I'}{nc:02d}" for it, nc in enumerate(hist)) + "M00#"
+            with global_metrics.timer('unpack'):
+                msg = unpack(bits77_int)
+            self.decodes[rows[i]] = (msg, decode_path, time.time(), bits77_int)
+            self.state[rows[i]] = self.DECODED
+            decoded.append(rows[i])
+        if params['OSD_ORDER'] >= 0:
+            near_miss = np.flatnonzero((self.state[rows] == self.FAILED) & (ncheck <= params['OSD_MAX_NCHECK']))
+            near_miss = near_miss[np.argsort(ncheck[near_miss], kind='stable')]
+            decoded += self.osd(rows[near_miss], ncheck_hist[near_miss], deadline)
+        return np.array(decoded, dtype=int)
 
-        self.decode_dict.update( {
-                            'msg_tuple':self.msg,
-                            'msg':' '.join(self.msg),
-                            'llr_sd':self.llr_sd,
-                            'decode_path':self.decode_path,
-                            'ncheck0': self.ncheck0,
-                            'snr': np.clip(int(np.max(self.dB) - np.min(self.dB) - 58), -24, 24),
-                            'td': f"{time.time() %60:4.1f}"
-                           })
-        
+    def osd(self, rows, ncheck_hist, deadline = None):
+        """OSD fallback for rows that failed BP, most promising first, until the table's osd_budget is spent
+        or the deadline (a time.time() value) passes."""
+        decoded = []
+        for row, hist in zip(rows, ncheck_hist):
+            if self.osd_budget <= 0 or (deadline is not None and time.time() >= deadline):
+                global_metrics.count('osd_skipped', 1)
+                continue
+            t0 = time.perf_counter()
+            result = osd_decode(self.llr[row], params['OSD_ORDER'])
+            elapsed = time.perf_counter() - t0
+            self.osd_budget -= elapsed
+            global_metrics.observe('osd', elapsed)
+            if result is None:
+                continue
+            bits91, hard_errors = result
+            bits77_int = int.from_bytes(np.packbits(bits91[:77]).tobytes(), 'big') >> 3
+            decode_path = ''.join(f"{'L' if it else 'I'}{nc:02d}" for it, nc in enumerate(hist[hist >= 0])) + f"O{hard_errors:02d}M00#"
+            with global_metrics.timer('unpack'):
+                msg = unpack(bits77_int)
+            self.decodes[row] = (msg, decode_path, time.time(), bits77_int)
+            self.ncheck[row] = 0
+            self.state[row] = self.DECODED
+            global_metrics.count('osd_decodes', 1)
+            decoded.append(row)
+        return decoded
 
+    def decode_dict(self, row):
+        spectrum = self.spectrum
+        bpt = spectrum.fbins_pertone
+        dt = float(self.h0_idx[row] * spectrum.dt - 0.7)
+        msg, decode_path, t_decoded, bits77_int = self.decodes.get(row, ('', '', 0, 0))
+        return {'decoder': 'PyFT8',
+                'cs':self.cyclestart_str,
+                'f':int((self.f0_idx[row] + bpt // 2) * spectrum.df),
+                'f0_idx': int(self.f0_idx[row]),
+                'sync_idx': self.sync_idx,
+                'sync': {'h0_idx':int(self.h0_idx[row]), 'score':float(self.score[row]), 'dt': dt},
+                'dt': int(0.5+100*dt)/100.0,
+                'ncheck0': int(self.ncheck0[row]),
+                'snr': int(self.snr[row]),
+                'llr_sd': float(self.llr_sd[row]),
+                'decode_path': decode_path,
+                'msg_tuple': msg, 'msg': ' '.join(msg),
+                'td': f"{t_decoded %60:4.1f}" if t_decoded else 0}
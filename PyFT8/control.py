@@ -0,0 +1,194 @@
+"""
+Local control endpoint for a running receiver, on a localhost UDP port or a Unix datagram socket. Commands are
+JSON datagrams, each answered with a JSON reply to the sender:
+
+    {"cmd": "tx", "msg": "CQ G1OJS IO90", "freq": 1000}     queue a message for the next cycle
+    {"cmd": "cancel"}                                          empty the queue and stop transmitting
+    {"cmd": "status"}
+
+Decodes are also sent to local apps (loggers, GridTracker, JTAlert, ...) as WSJT-X UDP Decode messages, in one
+burst per cycle at the cycle rollover, with a Heartbeat every cycle. WSJT-X Halt Tx and Free Text (send) messages
+from those apps are accepted as cancel and tx commands.
+"""
+
+import json
+import os
+import select
+import socket
+import struct
+import threading
+from PyFT8.metrics import global_metrics
+from PyFT8.time_utils import global_time_utils
+
+DEFAULT_CONTROL = '127.0.0.1:2238'
+WSJTX_MAGIC = 0xADBCCBDA
+WSJTX_SCHEMA = 2
+WSJTX_HEARTBEAT, WSJTX_DECODE, WSJTX_HALT_TX, WSJTX_FREE_TEXT = 0, 2, 8, 9
+
+def parse_address(address):
+    """('host', port) for 'host:port', or the path itself for a Unix socket path."""
+    if '/' in address:
+        return address
+    host, port = address.rsplit(':', 1)
+    return (host or '127.0.0.1', int(port))
+
+def open_socket(address, bind = True):
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    if bind:
+        if family == socket.AF_UNIX and os.path.exists(address):
+            os.remove(address)
+        try:
+            sock.bind(address)
+        except OSError:
+            sock.close()
+            raise
+    return sock
+
+def qstring(s):
+    b = s.encode()
+    return struct.pack('>I', len(b)) + b
+
+def read_qstring(data, pos):
+    n, = struct.unpack_from('>I', data, pos)
+    if n == 0xFFFFFFFF:
+        return '', pos + 4
+    return data[pos + 4:pos + 4 + n].decode(errors = 'replace'), pos + 4 + n
+
+def wsjtx_message(msg_type, client_id, payload = b''):
+    return struct.pack('>III', WSJTX_MAGIC, WSJTX_SCHEMA, msg_type) + qstring(client_id) + payload
+
+def wsjtx_heartbeat(client_id, version = 'PyFT8'):
+    return wsjtx_message(WSJTX_HEARTBEAT, client_id, struct.pack('>I', 3) + qstring(version) + qstring(''))
+
+def wsjtx_decode(client_id, dd):
+    cs = dd['cs']
+    ms = 1000 * (3600 * int(cs[7:9]) + 60 * int(cs[9:11]) + int(cs[11:13])) if len(cs) == 13 else 0
+    return wsjtx_message(WSJTX_DECODE, client_id, struct.pack('>?IidI', True, ms, dd['snr'], dd['dt'], max(dd['f'], 0))
+                         + qstring('~') + qstring(dd['msg']) + struct.pack('>??', False, False))
+
+class ControlServer:
+    def __init__(self, cycle_manager, address = DEFAULT_CONTROL, wsjtx_udp = None, client_id = 'PyFT8'):
+        """Serve commands for cycle_manager on address ('host:port' or a Unix socket path), and if wsjtx_udp
+        ('host:port') is given send decodes there. Pass on_decode to the receiver as (or from) its on_decode.
+        cycle_manager may be None, to bind the socket before opening the receiver, and set once it is running.
+        With address None there are no commands, only the WSJT-X messages (sent from an ephemeral port).
+        Raises OSError if the address can't be bound."""
+        self.cycle_manager = cycle_manager
+        self.commands = bool(address)
+        self.address = parse_address(address) if address else ('127.0.0.1', 0)
+        self.sock = open_socket(self.address)
+        self.wsjtx_address = parse_address(wsjtx_udp) if wsjtx_udp else None
+        self.wsjtx_sock = None
+        if self.wsjtx_address:
+            self.wsjtx_sock = self.sock if not isinstance(self.address, str) else open_socket(self.wsjtx_address, bind = False)
+        self.client_id = client_id
+        self.pending = []
+        self.lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def on_decode(self, dd):
+        if self.wsjtx_sock is not None:
+            with self.lock:
+                self.pending.append(dd)
+
+    def run(self):
+        rollover = global_time_utils.new_ticker(0)
+        while self.running:
+            readable, _, _ = select.select([self.sock], [], [], 0.1)
+            if readable:
+                try:
+                    data, sender = self.sock.recvfrom(65536)
+                    reply = self.handle(data)
+                    if reply is not None and sender:
+                        self.sock.sendto(json.dumps(reply).encode(), sender)
+                except OSError:
+                    # e.g. an ICMP port unreachable left over from a decode sent while no app was listening
+                    pass
+            if global_time_utils.check_ticker(rollover):
+                self.flush(heartbeat = True)
+        self.flush()
+
+    def flush(self, heartbeat = False):
+        """Send the decodes received since the last flush as WSJT-X Decode messages, back to back."""
+        if self.wsjtx_sock is None:
+            return
+        with self.lock:
+            batch, self.pending = self.pending, []
+        datagrams = [wsjtx_heartbeat(self.client_id)] if heartbeat else []
+        datagrams += [wsjtx_decode(dd.get('receiver') or self.client_id, dd) for dd in batch]
+        for datagram in datagrams:
+            try:
+                self.wsjtx_sock.sendto(datagram, self.wsjtx_address)
+            except OSError:
+                global_metrics.count('wsjtx_udp_errors', 1)
+        global_metrics.count('wsjtx_udp_decodes', len(batch))
+
+    def handle(self, data):
+        """Act on one datagram and return the reply (None for WSJT-X messages, which expect none)."""
+        if len(data) >= 12 and struct.unpack_from('>I', data)[0] == WSJTX_MAGIC:
+            self.handle_wsjtx(data)
+            return None
+        if not self.commands:
+            return None
+        try:
+            command = json.loads(data)
+            return self.command(command.pop('cmd'), **command)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return {'ok': False, 'error': str(e)}
+
+    def command(self, cmd, **args):
+        cm = self.cycle_manager
+        if cm is None:
+            return {'ok': False, 'error': "Receiver is starting"}
+        if cmd == 'tx':
+            entry = cm.queue_tx(args['msg'], args.get('freq', 1000))
+            return {'ok': True, 'queued': {'msg': entry['msg'], 'freq': entry['freq']}}
+        if cmd == 'cancel':
+            return {'ok': True, 'cancelled': cm.cancel_tx()}
+        if cmd == 'status':
+            return dict(cm.tx_status(), ok = True, receiver = cm.receiver, cycle_time = round(global_time_utils.cycle_time(), 2),
+                        metrics = global_metrics.status_line())
+        return {'ok': False, 'error': f"Unknown command {cmd}"}
+
+    def handle_wsjtx(self, data):
+        msg_type, = struct.unpack_from('>I', data, 8)
+        if self.cycle_manager is None:
+            return
+        try:
+            _, pos = read_qstring(data, 12)
+            if msg_type == WSJTX_HALT_TX:
+                self.cycle_manager.cancel_tx()
+            elif msg_type == WSJTX_FREE_TEXT:
+                text, pos = read_qstring(data, pos)
+                if data[pos]:
+                    self.cycle_manager.queue_tx(text.strip())
+        except (ValueError, IndexError, struct.error) as e:
+            global_time_utils.tlog(f"[Control] ignored WSJT-X message type {msg_type}: {e}", verbose = self.cycle_manager.verbose)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+def send_command(address, cmd, timeout = 2.0, **args):
+    """Send a command to a ControlServer and return its reply."""
+    address = parse_address(address)
+    reply_path = None
+    if isinstance(address, str):
+        reply_path = f"{address}.{os.getpid()}"
+        sock = open_socket(reply_path)
+    else:
+        sock = open_socket(address, bind = False)
+    try:
+        sock.settimeout(timeout)
+        sock.sendto(json.dumps(dict(args, cmd = cmd)).encode(), address)
+        return json.loads(sock.recv(65536))
+    finally:
+        sock.close()
+        if reply_path:
+            os.remove(reply_path)
@@ -1,18 +1,58 @@
 import threading
+import heapq
 import numpy as np
 import time
-from PyFT8.candidate import Candidate
+from PyFT8.candidate import CandidateTable
 from PyFT8.spectrum import Spectrum
 from PyFT8.audio import find_device
 from PyFT8.time_utils import global_time_utils
-import os
+from PyFT8.metrics import global_metrics
+from PyFT8.FT8_unpack import cache_stats
+from collections import deque
+
+TX_LATE_START = 1.0     # seconds into a cycle that a newly queued message may still start transmitting
+
+def wait_for_rollover(cycle_seconds):
+    delay = cycle_seconds - global_time_utils.cycle_time()
+    global_time_utils.tlog(f"[Cycle manager] Waiting for cycle rollover ({delay:3.1f}s)\n")
+    time.sleep(delay)
 
 class Cycle_manager():
     def __init__(self, sigspec, on_decode, wav_input = None, run = True, on_finished = False, 
                  input_device_keywords = None, output_device_keywords = None,
-                 freq_range = [200, 3100], verbose = False):
+                 freq_range = [200, 3100], verbose = False, max_batch = 200, decode_workers = 0,
+                 metrics_file = None, passes = 1, passes_window = [13.6, 14.6], passes_margin = 0.2, spectrum_shm = None,
+                 archive = None, archive_cycles = 240, archive_encoding = 'uint8', record = None, record_max_files = None,
+                 receiver = None, input_channel = 0, decode_pool = None, open_input = True, summarise_metrics = True):
         self.spectrum = Spectrum(sigspec, 12000, freq_range[1], 4, 2)
+        if(spectrum_shm):
+            self.spectrum.audio_in.enable_spectrum_ring(self.spectrum.df, shm_name = spectrum_shm)
         self.verbose = verbose
+        self.max_batch = max_batch
+        self.passes = passes
+        self.passes_window = passes_window
+        self.passes_margin = passes_margin
+        # Subtraction passes work on a copy of the spectrogram, leaving dB_main as received (for the archive)
+        self.residual = Spectrum(sigspec, 12000, freq_range[1], 4, 2) if passes > 1 else None
+        self.metrics_file = metrics_file
+        self.receiver = receiver
+        self.input_channel = input_channel
+        self.summarise_metrics = summarise_metrics
+        self.decode_pool = decode_pool
+        self.own_pool = bool(decode_workers and not decode_pool)
+        self.stopped = threading.Event()
+        self.archive = None
+        if(archive):
+            from PyFT8.spectrogram_archive import SpectrogramArchive
+            self.archive = SpectrogramArchive(archive, self.spectrum.hops_percycle, self.spectrum.nFreqs,
+                                              archive_cycles, archive_encoding, sigspec.cycle_seconds)
+        if(self.own_pool):
+            from PyFT8.decode_pool import DecodePool
+            self.decode_pool = DecodePool(decode_workers)
+        if(self.decode_pool):
+            self.decode_pool.add_spectrum(self.spectrum, receiver)
+        if(record):
+            self.spectrum.audio_in.enable_recorder(record, sigspec.cycle_seconds, record_max_files)
         self.f0_idxs = range(int(freq_range[0]/self.spectrum.df),
                         min(self.spectrum.nFreqs - self.spectrum.fbins_per_signal, int(freq_range[1]/self.spectrum.df)))
         self.input_device_idx = find_device(input_device_keywords)
@@ -22,76 +62,202 @@ class Cycle_manager():
         self.wav_input = wav_input
         if(self.output_device_idx):
             from PyFT8.audio import AudioOut
-            self.audio_out = AudioOut
-        if(self.wav_input is None):
-            self.spectrum.audio_in.start_live(self.input_device_idx)
-            delay = self.spectrum.sigspec.cycle_seconds - global_time_utils.cycle_time()
-            global_time_utils.tlog(f"[Cycle manager] Waiting for cycle rollover ({delay:3.1f}s)\n")
-            time.sleep(delay)
-        else:
-            global_time_utils.set_global_offset(0)
-            global_time_utils.set_global_offset(global_time_utils.cycle_time() + 1)
-            threading.Thread(target=self.spectrum.audio_in.load_wav, args = (self.wav_input, self.spectrum.dt, ),  daemon=True).start()
+            self.audio_out = AudioOut()
+        self.tx_queue = deque()
+        self.transmitting = None
+        self.tx_stop = threading.Event()
+        self.tx_lock = threading.Lock()
+        if(open_input):
+            if(self.wav_input is not None):
+                global_time_utils.set_global_offset(0)
+                global_time_utils.set_global_offset(global_time_utils.cycle_time() + 1)
+            self.start_input()
+            if(self.wav_input is None):
+                wait_for_rollover(self.spectrum.sigspec.cycle_seconds)
 
         if(run):
             threading.Thread(target=self.manage_cycle, daemon=True).start()
 
+    def start_input(self):
+        """Start the wav file (played in real time) or the live input device feeding this receiver's spectrum."""
+        if(self.wav_input is None):
+            self.spectrum.audio_in.start_live(self.input_device_idx, self.input_channel)
+        else:
+            audio_in = self.spectrum.audio_in
+            audio_in.input_thread = threading.Thread(target=audio_in.load_wav, args = (self.wav_input, self.spectrum.dt, self.input_channel),  daemon=True)
+            audio_in.input_thread.start()
+
+    def stop(self):
+        """Stop the input and any transmission, and make manage_cycle return at its next turn round the loop."""
+        self.stopped.set()
+        self.cancel_tx()
+        self.spectrum.audio_in.close()
+
+    def close(self):
+        """stop(), and shut down the decode pool if this receiver started it. Call once manage_cycle has returned."""
+        self.stop()
+        if(self.own_pool):
+            self.decode_pool.close()
+
+    def queue_tx(self, tx_msg, tx_freq = 1000):
+        """Queue a message to transmit at tx_freq Hz from the start of the next cycle, or straight away if this
+        cycle started less than TX_LATE_START seconds ago. Raises ValueError if it can't be sent."""
+        if(not self.output_device_idx):
+            raise ValueError("No output device specified")
+        try:
+            symbols = self.audio_out.create_ft8_symbols(tx_msg)
+        except Exception as e:
+            raise ValueError(f"Can't encode '{tx_msg}': {e}")
+        entry = {'msg': tx_msg, 'freq': int(tx_freq), 'symbols': symbols}
+        self.tx_queue.append(entry)
+        global_time_utils.tlog(f"[Tx] queued {tx_msg} on {tx_freq} Hz", verbose = self.verbose)
+        if global_time_utils.cycle_time(self.spectrum.sigspec.cycle_seconds) < TX_LATE_START:
+            self.check_for_tx()
+        return entry
+
+    def cancel_tx(self):
+        """Empty the transmit queue and stop any transmission in progress. Returns the number of messages cancelled."""
+        with self.tx_lock:
+            n = len(self.tx_queue) + (self.transmitting is not None)
+            self.tx_queue.clear()
+            self.tx_stop.set()
+        return n
+
+    def tx_status(self):
+        transmitting = self.transmitting
+        return {'transmitting': transmitting and {'msg': transmitting['msg'], 'freq': transmitting['freq']},
+                'queue': [{'msg': e['msg'], 'freq': e['freq']} for e in list(self.tx_queue)],
+                'output_device': self.output_device_idx}
+
     def check_for_tx(self):
-        tx_msg_file = 'PyFT8_tx_msg.txt'
-        if os.path.exists(tx_msg_file):
-            if(not self.output_device_idx):
-                global_time_utils.tlog("[Tx] Tx message file found but no output device specified", verbose = True)
+        with self.tx_lock:
+            if self.transmitting is not None or not self.tx_queue:
                 return
-            with open(tx_msg_file, 'r') as f:
-                tx_msg = f.readline().strip()
-                tx_freq = f.readline().strip()
-            tx_freq = int(tx_freq) if tx_freq else 1000    
-            global_time_utils.tlog(f"[TX] transmitting {tx_msg} on {tx_freq} Hz", verbose = self.verbose)
-            os.remove(tx_msg_file)
-            symbols = self.audio_out.create_ft8_symbols(tx_msg_file)
-            audio_data = self.audio_out.create_ft8_wave(symbols, f_base = tx_freq)
-            self.audio_out.play_data_to_soundcard(audio_data, self.output_device_idx)
-            global_time_utils.tlog("[Tx] done transmitting", verbose = self.verbose)
+            self.transmitting = self.tx_queue.popleft()
+            self.tx_stop.clear()
+        threading.Thread(target = self.transmit, args = (self.transmitting,), daemon = True).start()
+
+    def transmit(self, entry):
+        global_time_utils.tlog(f"[TX] transmitting {entry['msg']} on {entry['freq']} Hz", verbose = self.verbose)
+        audio_data = self.audio_out.create_ft8_wave(entry['symbols'], f_base = entry['freq'])
+        try:
+            self.audio_out.play_data_to_soundcard(audio_data, self.output_device_idx, stop = self.tx_stop)
+        finally:
+            self.transmitting = None
+        global_time_utils.tlog("[Tx] done transmitting" if not self.tx_stop.is_set() else "[Tx] cancelled", verbose = self.verbose)
+
+    def archive_cycle(self):
+        """Copy the cycle that has just ended out of dB_main and archive it in the background."""
+        cycle_seconds = self.spectrum.sigspec.cycle_seconds
+        cycle_start = time.time() - global_time_utils.global_offset - global_time_utils.cycle_time(cycle_seconds) - cycle_seconds
+        dB = self.spectrum.audio_in.dB_main.copy()
+        def store():
+            with global_metrics.timer('archive'):
+                cyclestart_str = self.archive.store(dB, round(cycle_start))
+                self.archive.flush()
+            global_time_utils.tlog(f"[Cycle manager] archived spectrogram for {cyclestart_str}", verbose = self.verbose)
+        threading.Thread(target = store, daemon = True).start()
         
     def manage_cycle(self):
         dashes = "======================================================"
-        candidates = []
-        block2_cands = []
+        candidates = CandidateTable(self.spectrum, [], [], [], '')
         duplicate_filter = set()
         rollover = global_time_utils.new_ticker(0)
         search = global_time_utils.new_ticker(11)
 
         def summarise_cycle():
-            unfinished = [c for c in candidates if not c.decode_completed]
-            nu = len(unfinished)
+            nu = int(np.sum(candidates.state <= CandidateTable.DEMAPPED))
+            ns = int(np.sum(candidates.state == CandidateTable.DECODED))
+            nf = int(np.sum(candidates.state == CandidateTable.FAILED))
+            global_metrics.count('decoded', ns)
+            global_metrics.count('failed', nf)
+            global_metrics.count('unfinished', nu)
+            if self.summarise_metrics:
+                unpack_stats = cache_stats()
+                for name, value in unpack_stats.pop('call_hashes').items():
+                    global_metrics.gauge('call_hash_' + name, value)
+                for name, value in unpack_stats.items():
+                    global_metrics.gauge(name, value)
+                if self.spectrum.audio_in.recorder is not None:
+                    global_metrics.gauge('recorder_queued', self.spectrum.audio_in.recorder.queue.qsize())
+                if self.decode_pool is not None:
+                    for name, stats in self.decode_pool.stats().items():
+                        name = ''.join(c if c.isalnum() else '_' for c in name)
+                        global_metrics.gauge('decode_pool_seconds_' + name, round(stats['seconds'], 3))
+                global_metrics.end_cycle()
+                if(self.metrics_file):
+                    global_metrics.write_prometheus(self.metrics_file)
             if(self.on_finished):
-                self.on_finished({"n_unfinished":nu, "spec_df":self.spectrum.df})
+                self.on_finished({"n_unfinished":nu, "n_decoded":ns, "n_failed":nf, "spec_df":self.spectrum.df,
+                                  "receiver":self.receiver, "cs":candidates.cyclestart_str})
             if(self.verbose):
-                with_message = [c for c in candidates if c.msg]
-                failed = [c for c in candidates if c.decode_completed and not c.msg]
-                ns, nf = len(with_message), len(failed)
-                global_time_utils.tlog(f"[Cycle manager] Last cycle had {ns} decodes, {nf} failures and {nu} unfinished (total = {ns+nf+nu})")   
+                global_time_utils.tlog(f"[Cycle manager] {self.receiver or 'Last'} cycle had {ns} decodes, {nf} failures and {nu} unfinished (total = {ns+nf+nu})")   
 
         self.spectrum.audio_in.main_ptr = 0
         main_ptr_prev = 0
-        while not self.spectrum.audio_in.wav_finished:
-            time.sleep(0.001)
-                
+        hops_seen = 0
+        payload_queue = []
+        ready_to_decode = np.zeros(0, dtype=int)
+        passes_done, pass_table, pass_new_rows = 1, candidates, []
+        def report_decodes(table, rows):
+            new_rows = []
+            for row in rows:
+                key = table.cyclestart_str + " " + " ".join(table.decodes[row][0])
+                if key not in duplicate_filter:
+                    duplicate_filter.add(key)
+                    new_rows.append(row)
+                    dd = table.decode_dict(row)
+                    if self.receiver is not None:
+                        dd['receiver'] = self.receiver
+                    self.on_decode(dd)
+                    if table.cycle_start_time is not None:
+                        frame_end = table.cycle_start_time + 0.5 + dd['sync']['dt'] + self.spectrum.sigspec.num_symbols / self.spectrum.sigspec.symbols_persec
+                        global_metrics.observe('frame_end_to_decode', time.time() - frame_end)
+            if table is pass_table:
+                pass_new_rows.extend(new_rows)
+
+        while not self.spectrum.audio_in.wav_finished and not self.stopped.is_set():
+            if not len(ready_to_decode):
+                waiting_on_pool = self.decode_pool and self.decode_pool.busy(self.spectrum)
+                hops_seen = self.spectrum.audio_in.wait_for_hops(hops_seen, timeout = 0.02 if waiting_on_pool else 0.1)
+
             ptr = self.spectrum.audio_in.main_ptr
-            new_to_decode = []
-            for c in candidates:
-                if ptr > c.last_payload_hop and not c.demap_started:
-                    c.demap(self.spectrum)
-                if c.llr_sd > 0 and not c.decode_completed:
-                    new_to_decode.append(c)
-                if c.msg:
-                    key = c.cyclestart_str + " " + " ".join(c.msg)
-                    if key not in duplicate_filter:
-                        duplicate_filter.add(key)
-                        self.on_decode(c.decode_dict)
-            new_to_decode.sort(key=lambda c: c.llr_sd, reverse=True)
-            for c in new_to_decode[:35]:
-                c.decode()
+            payload_complete = []
+            while payload_queue and ptr > payload_queue[0][0]:
+                payload_complete.append(heapq.heappop(payload_queue)[1])
+            payload_complete = np.array(payload_complete, dtype=int)
+            if self.decode_pool:
+                if len(payload_complete):
+                    self.decode_pool.submit(candidates, payload_complete)
+                for table, rows in self.decode_pool.completed(self.spectrum):
+                    report_decodes(table, rows)
+            elif len(payload_complete):
+                candidates.demap(payload_complete)
+                ready_to_decode = np.concatenate((ready_to_decode, payload_complete[candidates.llr_sd[payload_complete] > 0]))
+            if len(ready_to_decode):
+                ready_to_decode = ready_to_decode[np.argsort(-candidates.llr_sd[ready_to_decode], kind='stable')]
+                to_decode, ready_to_decode = ready_to_decode[:self.max_batch], ready_to_decode[self.max_batch:]
+                report_decodes(candidates, candidates.decode(to_decode))
+
+            # Subtraction passes: once most frames are complete, remove the decoded signals from the
+            # spectrogram and search the residual again, for as long as each pass finds something new
+            if (passes_done < self.passes and pass_new_rows and not len(ready_to_decode)
+                    and not (self.decode_pool and self.decode_pool.busy(self.spectrum))
+                    and self.passes_window[0] < global_time_utils.cycle_time() < self.passes_window[1]):
+                # The STFT is still writing the end of the frame, so the copy is only good below pass_hops
+                if passes_done == 1:
+                    pass_hops = ptr
+                    self.residual.audio_in.dB_main[:] = self.spectrum.audio_in.dB_main
+                self.residual.subtract_decodes(pass_table, pass_new_rows, pass_hops)
+                cycle_seconds = self.spectrum.sigspec.cycle_seconds
+                deadline = time.time() + cycle_seconds - global_time_utils.cycle_time(cycle_seconds) - self.passes_margin
+                pass_table, decoded = self.residual.search_and_decode(self.f0_idxs, candidates.cyclestart_str, pass_table.osd_budget,
+                                                                       deadline, max_hop = pass_hops)
+                pass_table.cycle_start_time = candidates.cycle_start_time
+                pass_new_rows = []
+                report_decodes(pass_table, decoded)
+                passes_done += 1
+                global_metrics.count('decoded_after_subtraction', len(pass_new_rows))
 
             if(ptr != main_ptr_prev):
                 main_ptr_prev = ptr
@@ -99,11 +265,18 @@ class Cycle_manager():
                 if(global_time_utils.check_ticker(rollover)):
                     global_time_utils.tlog(f"{dashes}\n[Cycle manager] rollover detected at {global_time_utils.cycle_time():.2f}", verbose = self.verbose)
                     self.check_for_tx()
+                    if(self.archive):
+                        self.archive_cycle()
                     self.spectrum.audio_in.main_ptr = 0
                 if (global_time_utils.check_ticker(search)):
                     summarise_cycle()
                     global_time_utils.tlog(f"[Cycle manager] start search at hop { self.spectrum.audio_in.main_ptr}", verbose = self.verbose)
                     candidates = self.spectrum.search(self.f0_idxs, global_time_utils.cyclestart_str(time.time()))
+                    candidates.cycle_start_time = time.time() - global_time_utils.cycle_time()
+                    payload_queue = list(zip(candidates.last_payload_hop.tolist(), range(len(candidates))))
+                    heapq.heapify(payload_queue)
+                    ready_to_decode = np.zeros(0, dtype=int)
+                    passes_done, pass_table, pass_new_rows = 1, candidates, []
                     global_time_utils.tlog(f"[Cycle manager] New spectrum searched -> {len(candidates)} candidates", verbose = self.verbose) 
 
 
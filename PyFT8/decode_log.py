@@ -0,0 +1,135 @@
+"""
+Persistent decode log. DecodeLog.on_decode only queues the decode dict; a writer thread batches the queue
+into an ALL.TXT-format log (as WSJT-X), a JSON lines file and an indexed SQLite database:
+
+    log = DecodeLog(all_txt = 'ALL.TXT', db = 'decodes.db')
+    Cycle_manager(FT8, on_decode = log.on_decode, ...)
+    query_decodes('decodes.db', call = 'K1ABC', since = '250101_000000')
+"""
+
+import json
+import queue
+import re
+import sqlite3
+import threading
+import time
+from PyFT8.metrics import global_metrics
+
+GRID_RE = re.compile(r'^[A-R]{2}[0-9]{2}$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS decodes (
+    id INTEGER PRIMARY KEY,
+    cycle TEXT NOT NULL,
+    receiver TEXT,
+    freq INTEGER,
+    snr INTEGER,
+    dt REAL,
+    msg TEXT,
+    call1 TEXT,
+    call2 TEXT,
+    grid TEXT,
+    decode_path TEXT
+);
+CREATE INDEX IF NOT EXISTS decodes_cycle ON decodes (cycle);
+CREATE INDEX IF NOT EXISTS decodes_call1 ON decodes (call1, cycle);
+CREATE INDEX IF NOT EXISTS decodes_call2 ON decodes (call2, cycle);
+CREATE INDEX IF NOT EXISTS decodes_grid ON decodes (grid, cycle);
+CREATE INDEX IF NOT EXISTS decodes_freq ON decodes (freq, cycle);
+"""
+
+def all_txt_line(dd, dial_mhz = 0.0, mode = 'FT8'):
+    return f"{dd['cs']} {dial_mhz:10.3f} Rx {mode:<4} {dd['snr']:6d} {dd['dt']:4.1f} {dd['f']:4d} {dd['msg']}"
+
+def db_row(dd):
+    words = list(dd.get('msg_tuple') or dd['msg'].split())
+    call1, call2 = (words + ['', ''])[:2]
+    grid = words[2] if len(words) > 2 and GRID_RE.match(words[2]) else None
+    return (dd['cs'], dd.get('receiver'), dd['f'], dd['snr'], dd['dt'], dd['msg'],
+            call1.strip('<>') or None, call2.strip('<>') or None, grid, dd.get('decode_path'))
+
+class DecodeLog:
+    def __init__(self, all_txt = None, jsonl = None, db = None, dial_mhz = 0.0, flush_seconds = 1.0, max_queue = 10000):
+        """Log decodes to any of an ALL.TXT file, a JSON lines file and a SQLite database (paths, appended to).
+        Writes happen at most every flush_seconds; decodes arriving with max_queue already waiting are dropped."""
+        self.all_txt, self.jsonl, self.db = all_txt, jsonl, db
+        self.dial_mhz = dial_mhz
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue(maxsize = max_queue)
+        self.dropped = 0
+        self.written = 0
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def on_decode(self, dd):
+        """Queue a decode dict for logging. Never blocks."""
+        try:
+            self.queue.put_nowait(dd)
+        except queue.Full:
+            self.dropped += 1
+            global_metrics.count('decode_log_dropped', 1)
+
+    def run(self):
+        connection = None
+        if self.db:
+            connection = sqlite3.connect(self.db)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+        finished = False
+        while not finished:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_seconds
+            while batch[-1] is not None and len(batch) < 1000:
+                try:
+                    batch.append(self.queue.get(timeout = max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            if None in batch:
+                finished = True
+                batch = [dd for dd in batch if dd is not None]
+            if batch:
+                with global_metrics.timer('decode_log_write'):
+                    self.write(batch, connection)
+        if connection is not None:
+            connection.close()
+
+    def write(self, batch, connection):
+        if self.all_txt:
+            with open(self.all_txt, 'a') as f:
+                f.write(''.join(all_txt_line(dd, self.dial_mhz) + '\n' for dd in batch))
+        if self.jsonl:
+            with open(self.jsonl, 'a') as f:
+                f.write(''.join(json.dumps(dd, default = str) + '\n' for dd in batch))
+        if connection is not None:
+            with connection:
+                connection.executemany("INSERT INTO decodes (cycle, receiver, freq, snr, dt, msg, call1, call2, grid, decode_path) "
+                                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [db_row(dd) for dd in batch])
+        self.written += len(batch)
+
+    def close(self):
+        """Write out everything queued, then stop the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+def query_decodes(db, call = None, grid = None, since = None, until = None, fmin = None, fmax = None, limit = 1000):
+    """Decodes from a DecodeLog database matching all the given filters (call matches either callsign;
+    since and until are cyclestart_str values), newest first, as dicts."""
+    where, args = [], []
+    if call:
+        where.append("(call1 = ? OR call2 = ?)")
+        args += [call, call]
+    if grid:
+        where.append("grid = ?")
+        args.append(grid)
+    for clause, value in (("cycle >= ?", since), ("cycle <= ?", until), ("freq >= ?", fmin), ("freq <= ?", fmax)):
+        if value is not None:
+            where.append(clause)
+            args.append(value)
+    sql = "SELECT * FROM decodes" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY cycle DESC LIMIT ?"
+    connection = sqlite3.connect(db)
+    connection.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in connection.execute(sql, args + [limit])]
+    finally:
+        connection.close()
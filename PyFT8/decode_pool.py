@@ -0,0 +1,140 @@
+"""
+Optional pool of decode worker processes, which any number of receivers can share. Each receiver's spectrogram
+(AudioIn.dB_main) is moved into shared memory so that workers can demap candidates from it directly, and jobs
+are sent as (f0_idx, h0_idx) pairs. Chunks of jobs wait in a queue per receiver and are handed to the workers
+round robin, a few at a time, so that a busy band cannot starve a quiet one.
+"""
+
+import atexit
+import threading
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from PyFT8.candidate import CandidateTable
+from PyFT8.FT8_unpack import unpack
+
+_worker = {}    # shm name -> (shm, Spectrum)
+
+def _attach(shm_name, shape, spectrum_args):
+    if shm_name not in _worker:
+        from PyFT8.spectrum import Spectrum
+        shm = shared_memory.SharedMemory(name = shm_name)
+        spectrum = Spectrum(*spectrum_args)
+        spectrum.audio_in.dB_main = np.ndarray(shape, dtype = np.float32, buffer = shm.buf)
+        _worker[shm_name] = (shm, spectrum)
+    return _worker[shm_name][1]
+
+def _decode_jobs(receiver_args, jobs, osd_budget):
+    t0 = time.perf_counter()
+    f0_idxs, h0_idxs = zip(*jobs)
+    table = CandidateTable(_attach(*receiver_args), f0_idxs, h0_idxs, np.zeros(len(jobs)), '')
+    table.osd_budget = osd_budget
+    rows = np.arange(len(table))
+    table.demap(rows)
+    table.decode(rows[table.llr_sd > 0])
+    return {'llr_sd': table.llr_sd, 'snr': table.snr, 'ncheck0': table.ncheck0, 'ncheck': table.ncheck,
+            'state': table.state, 'decodes': table.decodes, 'osd_seconds': osd_budget - table.osd_budget,
+            'seconds': time.perf_counter() - t0}
+
+class DecodePool:
+    def __init__(self, workers, chunk_size = 25, max_in_flight = None):
+        """Pool of worker processes. At most max_in_flight chunks (default two per worker) are with the
+        workers at once; the rest wait in their receiver's queue."""
+        self.pool = ProcessPoolExecutor(max_workers = workers)
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight or 2 * workers
+        self.receivers = {}     # Spectrum -> receiver dict
+        self.order = []         # receivers in round robin order
+        self.next_receiver = 0
+        self.in_flight = []
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def add_spectrum(self, spectrum, name = None):
+        """Move a spectrum's dB_main into shared memory, so that its candidates can be decoded by the pool."""
+        audio_in = spectrum.audio_in
+        shm = shared_memory.SharedMemory(create = True, size = audio_in.dB_main.nbytes)
+        dB_main = np.ndarray(audio_in.dB_main.shape, dtype = np.float32, buffer = shm.buf)
+        dB_main[:] = audio_in.dB_main
+        audio_in.dB_main = dB_main
+        spectrum_args = (spectrum.sigspec, spectrum.sample_rate, spectrum.max_freq, spectrum.hops_persymb, spectrum.fbins_pertone)
+        with self.lock:
+            receiver = {'name': str(len(self.order)) if name is None else name, 'shm': shm,
+                        'args': (shm.name, dB_main.shape, spectrum_args), 'queue': deque(), 'chunks': 0, 'seconds': 0.0}
+            self.receivers[spectrum] = receiver
+            self.order.append(receiver)
+
+    def submit(self, table, rows):
+        """Queue rows of a CandidateTable whose payload is complete in dB_main for the workers."""
+        with self.lock:
+            queue = self.receivers[table.spectrum]['queue']
+            for i in range(0, len(rows), self.chunk_size):
+                queue.append((table, rows[i:i + self.chunk_size]))
+            self._dispatch()
+
+    def _dispatch(self):
+        idle = 0
+        while len(self.in_flight) < self.max_in_flight and idle < len(self.order):
+            receiver = self.order[self.next_receiver]
+            self.next_receiver = (self.next_receiver + 1) % len(self.order)
+            if not receiver['queue']:
+                idle += 1
+                continue
+            idle = 0
+            table, chunk = receiver['queue'].popleft()
+            jobs = list(zip(table.f0_idx[chunk].tolist(), table.h0_idx[chunk].tolist()))
+            # Reserve this chunk's share of the table's OSD budget now, so chunks decoding at the same time
+            # can't each spend all of it; whatever it doesn't use is returned when its result comes back
+            osd_budget = max(table.osd_budget, 0) / (1 + sum(t is table for t, _ in receiver['queue']))
+            table.osd_budget -= osd_budget
+            self.in_flight.append((table, chunk, osd_budget, self.pool.submit(_decode_jobs, receiver['args'], jobs, osd_budget)))
+
+    def busy(self, spectrum = None):
+        """True while any chunks (of one spectrum's tables, if given) are queued or with the workers."""
+        with self.lock:
+            if spectrum is None:
+                return bool(self.in_flight) or any(r['queue'] for r in self.order)
+            return bool(self.receivers[spectrum]['queue']) or any(t.spectrum is spectrum for t, _, _, _ in self.in_flight)
+
+    def completed(self, spectrum = None):
+        """Apply finished worker results to their tables (only one spectrum's tables, if given) and return
+        a list of (table, decoded rows)."""
+        done = []
+        with self.lock:
+            still_running = []
+            for table, chunk, osd_budget, future in self.in_flight:
+                if not future.done() or (spectrum is not None and table.spectrum is not spectrum):
+                    still_running.append((table, chunk, osd_budget, future))
+                    continue
+                result = future.result()
+                for field in ('llr_sd', 'snr', 'ncheck0', 'ncheck', 'state'):
+                    getattr(table, field)[chunk] = result[field]
+                table.osd_budget += osd_budget - result['osd_seconds']
+                receiver = self.receivers[table.spectrum]
+                receiver['chunks'] += 1
+                receiver['seconds'] += result['seconds']
+                for i, decode in result['decodes'].items():
+                    # unpack again here, so that hashed calls resolve against (and update) this process's table
+                    table.decodes[chunk[i]] = (unpack(decode[3]),) + decode[1:]
+                done.append((table, chunk[list(result['decodes'])]))
+            self.in_flight = still_running
+            self._dispatch()
+        return done
+
+    def stats(self):
+        """Per receiver: chunks queued and decoded, and worker seconds spent on them."""
+        with self.lock:
+            return {r['name']: {'queued': len(r['queue']), 'chunks': r['chunks'], 'seconds': r['seconds']} for r in self.order}
+
+    def close(self):
+        if self.pool is None:
+            return
+        self.pool.shutdown(wait = False, cancel_futures = True)
+        self.pool = None
+        for spectrum, receiver in self.receivers.items():
+            # dB_main goes back to private memory, as anything still using the spectrum would crash on the unmapped buffer
+            spectrum.audio_in.dB_main = spectrum.audio_in.dB_main.copy()
+            receiver['shm'].close()
+            receiver['shm'].unlink()
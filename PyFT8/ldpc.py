@@ -1,11 +1,19 @@
 import numpy as np
 import warnings
+import time
+from PyFT8.metrics import global_metrics
 warnings.filterwarnings("error")
 
+# Parity check tables, shared by every decoder
+CV6idx = np.array([[4,31,59,92,114,145],[5,23,60,93,121,150],[6,32,61,94,95,142],[5,31,63,96,125,137],[8,34,65,98,138,145],[9,35,66,99,106,125],[11,37,67,101,104,154],[12,38,68,102,148,161],[14,41,58,105,122,158],[0,32,71,105,106,156],[15,42,72,107,140,159],[10,43,74,109,120,165],[7,45,70,111,118,165],[18,37,76,103,115,162],[19,46,69,91,137,164],[1,47,73,112,127,159],[21,46,57,117,126,163],[15,38,61,111,133,157],[22,42,78,119,130,144],[19,35,62,93,135,160],[13,30,78,97,131,163],[2,43,79,123,126,168],[18,45,80,116,134,166],[11,49,60,117,118,143],[12,50,63,113,117,156],[23,51,75,128,147,148],[20,53,76,99,139,170],[34,81,132,141,170,173],[13,29,82,112,124,169],[3,28,67,119,133,172],[51,83,109,114,144,167],[6,49,80,98,131,172],[22,54,66,94,171,173],[25,40,76,108,140,147],[26,39,55,123,124,125],[17,48,54,123,140,166],[5,32,84,107,115,155],[8,53,62,130,146,154],[21,52,67,108,120,173],[2,12,47,77,94,122],[30,68,132,149,154,168],[4,38,74,101,135,166],[1,53,85,100,134,163],[14,55,86,107,118,170],[22,33,70,93,126,152],[10,48,87,91,141,156],[28,33,86,96,146,161],[21,56,84,92,139,158],[27,31,71,102,131,165],[0,25,44,79,127,146],[16,26,88,102,115,152],[50,56,97,162,164,171],[20,36,72,137,151,168],[15,46,75,129,136,153],[2,23,29,71,103,138],[8,39,89,105,133,150],[17,41,78,143,145,151],[24,37,64,98,121,159],[16,41,74,128,169,171]], dtype = np.int16)
+CV7idx = np.array([[3,30,58,90,91,95,152],[7,24,62,82,92,95,147],[4,33,64,77,97,106,153],[10,36,66,86,100,138,157],[7,39,69,81,103,113,144],[13,40,70,87,101,122,155],[16,36,73,80,108,130,153],[44,54,63,110,129,160,172],[17,35,75,88,112,113,142],[20,44,77,82,116,120,150],[18,34,58,72,109,124,160],[6,48,57,89,99,104,167],[24,52,68,89,100,129,155],[19,45,64,79,119,139,169],[0,3,51,56,85,135,151],[25,50,55,90,121,136,167],[1,26,40,60,61,114,132],[27,47,69,84,104,128,157],[11,42,65,88,96,134,158],[9,43,81,90,110,143,148],[29,49,59,85,136,141,161],[9,52,65,83,111,127,164],[27,28,83,87,116,142,149],[14,57,59,73,110,149,162]], dtype = np.int16)
+CV6idx.setflags(write=False)
+CV7idx.setflags(write=False)
+
 class LdpcDecoder:
     def __init__(self):
-        self.CV6idx = np.array([[4,31,59,92,114,145],[5,23,60,93,121,150],[6,32,61,94,95,142],[5,31,63,96,125,137],[8,34,65,98,138,145],[9,35,66,99,106,125],[11,37,67,101,104,154],[12,38,68,102,148,161],[14,41,58,105,122,158],[0,32,71,105,106,156],[15,42,72,107,140,159],[10,43,74,109,120,165],[7,45,70,111,118,165],[18,37,76,103,115,162],[19,46,69,91,137,164],[1,47,73,112,127,159],[21,46,57,117,126,163],[15,38,61,111,133,157],[22,42,78,119,130,144],[19,35,62,93,135,160],[13,30,78,97,131,163],[2,43,79,123,126,168],[18,45,80,116,134,166],[11,49,60,117,118,143],[12,50,63,113,117,156],[23,51,75,128,147,148],[20,53,76,99,139,170],[34,81,132,141,170,173],[13,29,82,112,124,169],[3,28,67,119,133,172],[51,83,109,114,144,167],[6,49,80,98,131,172],[22,54,66,94,171,173],[25,40,76,108,140,147],[26,39,55,123,124,125],[17,48,54,123,140,166],[5,32,84,107,115,155],[8,53,62,130,146,154],[21,52,67,108,120,173],[2,12,47,77,94,122],[30,68,132,149,154,168],[4,38,74,101,135,166],[1,53,85,100,134,163],[14,55,86,107,118,170],[22,33,70,93,126,152],[10,48,87,91,141,156],[28,33,86,96,146,161],[21,56,84,92,139,158],[27,31,71,102,131,165],[0,25,44,79,127,146],[16,26,88,102,115,152],[50,56,97,162,164,171],[20,36,72,137,151,168],[15,46,75,129,136,153],[2,23,29,71,103,138],[8,39,89,105,133,150],[17,41,78,143,145,151],[24,37,64,98,121,159],[16,41,74,128,169,171]], dtype = np.int16)
-        self.CV7idx = np.array([[3,30,58,90,91,95,152],[7,24,62,82,92,95,147],[4,33,64,77,97,106,153],[10,36,66,86,100,138,157],[7,39,69,81,103,113,144],[13,40,70,87,101,122,155],[16,36,73,80,108,130,153],[44,54,63,110,129,160,172],[17,35,75,88,112,113,142],[20,44,77,82,116,120,150],[18,34,58,72,109,124,160],[6,48,57,89,99,104,167],[24,52,68,89,100,129,155],[19,45,64,79,119,139,169],[0,3,51,56,85,135,151],[25,50,55,90,121,136,167],[1,26,40,60,61,114,132],[27,47,69,84,104,128,157],[11,42,65,88,96,134,158],[9,43,81,90,110,143,148],[29,49,59,85,136,141,161],[9,52,65,83,111,127,164],[27,28,83,87,116,142,149],[14,57,59,73,110,149,162]], dtype = np.int16)
+        self.CV6idx = CV6idx
+        self.CV7idx = CV7idx
         self.mC2V_prev6 = None
         self.mC2V_prev7 = None
         
@@ -37,3 +45,52 @@ class LdpcDecoder:
         self.mC2V_prev7 = self._pass_messages(llr, self.CV7idx, self.mC2V_prev7, update_collector)
         llr += update_collector
         return llr, self.calc_ncheck(llr)
+
+    def calc_ncheck_batch(self, llrs):
+        parity6 = np.sum(llrs[:, self.CV6idx] > 0, axis=2) & 1
+        parity7 = np.sum(llrs[:, self.CV7idx] > 0, axis=2) & 1
+        return np.sum(parity6, axis=1) + np.sum(parity7, axis=1)
+
+    def _pass_messages_batch(self, llrs, CVidx, mC2V_prev, update_collector):
+        mV2C = llrs[:, CVidx] - mC2V_prev
+        tanh_mV2C = np.tanh(-mV2C)
+        tanh_mC2V = np.prod(tanh_mV2C, axis=2, keepdims=True)
+        has_zero = np.any(tanh_mV2C == 0, axis=(1, 2))
+        tanh_mC2V = tanh_mC2V / (tanh_mV2C + 0.001 * has_zero[:, None, None])
+        alpha_atanh_approx = 1.18
+        mC2V_curr  = tanh_mC2V / ((tanh_mC2V - alpha_atanh_approx) * (alpha_atanh_approx + tanh_mC2V))
+        nrows, nvars = llrs.shape
+        flat_idx = (np.arange(nrows)[:, None, None] * nvars + CVidx[None]).ravel()
+        update_collector += np.bincount(flat_idx, weights = (mC2V_curr - mC2V_prev).ravel(), minlength = nrows * nvars).reshape(nrows, nvars)
+        return mC2V_curr
+
+    def decode_batch(self, llrs, max_iterations, max_ncheck0 = None):
+        """Run belief propagation over an (N, 174) LLR matrix, one row per candidate.
+        Rows stop iterating as soon as they reach ncheck == 0, and rows starting above
+        max_ncheck0 are not iterated at all. Returns hard bits (N, 174), final ncheck (N,)
+        and the ncheck after each iteration (N, max_iterations + 1), padded with -1."""
+        llrs = np.array(llrs, dtype=np.float64)
+        nrows = llrs.shape[0]
+        ncheck = self.calc_ncheck_batch(llrs)
+        ncheck_hist = np.full((nrows, max_iterations + 1), -1, dtype=int)
+        ncheck_hist[:, 0] = ncheck
+        active = ncheck > 0
+        if max_ncheck0 is not None:
+            active &= ncheck <= max_ncheck0
+        mC2V6 = np.zeros((nrows,) + self.CV6idx.shape)
+        mC2V7 = np.zeros((nrows,) + self.CV7idx.shape)
+        for it in range(max_iterations):
+            rows = np.flatnonzero(active)
+            if not len(rows):
+                break
+            t0 = time.perf_counter()
+            llr = llrs[rows]
+            update_collector = np.zeros_like(llr)
+            mC2V6[rows] = self._pass_messages_batch(llr, self.CV6idx, mC2V6[rows], update_collector)
+            mC2V7[rows] = self._pass_messages_batch(llr, self.CV7idx, mC2V7[rows], update_collector)
+            llrs[rows] = llr + update_collector
+            ncheck[rows] = self.calc_ncheck_batch(llrs[rows])
+            ncheck_hist[rows, it + 1] = ncheck[rows]
+            active[rows] = ncheck[rows] > 0
+            global_metrics.observe('ldpc_iteration', time.perf_counter() - t0)
+        return llrs > 0, ncheck, ncheck_hist
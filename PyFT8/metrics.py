@@ -0,0 +1,119 @@
+"""
+Hot-path instrumentation: per-cycle counters and latency histograms for each decoder stage,
+available as a dict, as a one-line status summary and as a Prometheus text file.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.0001, 0.0003, 0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0)
+
+class Histogram:
+    def __init__(self, buckets = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value, n = 1):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += n
+        self.sum += n * value
+        self.count += n
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.totals = {}
+        self.gauges = {}
+        self.cycle = {'counters': {}, 'seconds': {}}
+        self.last_cycle = {'counters': {}, 'seconds': {}}
+
+    def observe(self, stage, seconds, n = 1):
+        """Record n observations of seconds each (n > 1 for work done in a batch and timed as a whole)."""
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds, n)
+            self.cycle['seconds'][stage] = self.cycle['seconds'].get(stage, 0.0) + n * seconds
+
+    @contextmanager
+    def timer(self, stage):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def count(self, name, n = 1):
+        with self.lock:
+            self.totals[name] = self.totals.get(name, 0) + n
+            self.cycle['counters'][name] = self.cycle['counters'].get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def end_cycle(self):
+        """Close the current cycle's counters; they stay readable as last_cycle until the next call."""
+        with self.lock:
+            self.last_cycle = self.cycle
+            self.cycle = {'counters': {}, 'seconds': {}}
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'totals': dict(self.totals),
+                'gauges': dict(self.gauges),
+                'last_cycle': {'counters': dict(self.last_cycle['counters']), 'seconds': dict(self.last_cycle['seconds'])},
+                'histograms': {stage: {'buckets': list(h.buckets), 'counts': list(h.counts), 'sum': h.sum, 'count': h.count}
+                               for stage, h in self.histograms.items()},
+            }
+
+    def status_line(self):
+        """Short summary of the last cycle, for status bars."""
+        snap = self.snapshot()
+        c, s, h = snap['last_cycle']['counters'], snap['last_cycle']['seconds'], snap['histograms']
+        parts = [f"search {1000 * s.get('sync_search', 0):.0f}ms", f"demap {1000 * s.get('demap', 0):.0f}ms"]
+        if h.get('ldpc_iteration', {}).get('count'):
+            parts.append(f"ldpc {1000 * h['ldpc_iteration']['sum'] / h['ldpc_iteration']['count']:.1f}ms/it")
+        parts.append(f"dec {c.get('decoded', 0)} fail {c.get('failed', 0)} unf {c.get('unfinished', 0)} of {c.get('candidates_searched', 0)}")
+        if h.get('frame_end_to_decode', {}).get('count'):
+            parts.append(f"lat {h['frame_end_to_decode']['sum'] / h['frame_end_to_decode']['count']:.2f}s")
+        g = snap['gauges']
+        if 'call_hash_calls' in g:
+            parts.append(f"hash {g['call_hash_calls']} calls {100 * g['call_hash_hit_rate']:.0f}% hits")
+        return "  ".join(parts)
+
+    def prometheus_text(self, prefix = 'pyft8'):
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap['totals'].items()):
+            lines += [f"# TYPE {prefix}_{name}_total counter", f"{prefix}_{name}_total {value}"]
+        for name, value in sorted(snap['gauges'].items()):
+            lines += [f"# TYPE {prefix}_{name} gauge", f"{prefix}_{name} {value}"]
+        for name, value in sorted(snap['last_cycle']['counters'].items()):
+            lines += [f"# TYPE {prefix}_last_cycle_{name} gauge", f"{prefix}_last_cycle_{name} {value}"]
+        for stage, h in sorted(snap['histograms'].items()):
+            metric = f"{prefix}_{stage}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for le, n in zip(list(h['buckets']) + ['+Inf'], h['counts']):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+            lines += [f"{metric}_sum {h['sum']}", f"{metric}_count {h['count']}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """Write the Prometheus text format to path atomically (for node_exporter's textfile collector)."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+global_metrics = Metrics()
@@ -0,0 +1,69 @@
+"""
+Several receivers in one process. Each receiver (an input device, one channel of a device, or a wav file) has its
+own Spectrum and Cycle_manager, and all of them share one DecodePool, which hands their candidates to the worker
+processes round robin. Every decode is tagged with its receiver's name as dd['receiver']:
+
+    MultiReceiver(FT8, on_decode, [{'receiver': '40m', 'input_device_keywords': ['USB'], 'input_channel': 0},
+                                   {'receiver': '20m', 'input_device_keywords': ['USB'], 'input_channel': 1}])
+"""
+
+import threading
+from PyFT8.audio import start_live_channels
+from PyFT8.cycle_manager import Cycle_manager, wait_for_rollover
+from PyFT8.decode_pool import DecodePool
+from PyFT8.time_utils import global_time_utils
+
+class MultiReceiver:
+    def __init__(self, sigspec, on_decode, receivers, decode_workers = None, run = True, **kwargs):
+        """receivers is a list of dicts of Cycle_manager arguments, one per receiver, and kwargs are arguments
+        common to all of them. decode_workers defaults to one per receiver. The first receiver writes the
+        metrics and is the one to give an output device for transmitting."""
+        self.decode_pool = DecodePool(decode_workers or len(receivers))
+        self.managers = []
+        for i, receiver in enumerate(receivers):
+            args = dict(kwargs, **receiver)
+            args.setdefault('receiver', str(i))
+            self.managers.append(Cycle_manager(sigspec, on_decode, run = False, open_input = False, decode_pool = self.decode_pool,
+                                               summarise_metrics = not self.managers, **args))
+
+        wav_managers = [m for m in self.managers if m.wav_input is not None]
+        if(wav_managers):
+            global_time_utils.set_global_offset(0)
+            global_time_utils.set_global_offset(global_time_utils.cycle_time() + 1)
+            for manager in wav_managers:
+                manager.start_input()
+        devices = {}
+        for manager in self.managers:
+            if manager.wav_input is None:
+                audio_ins = devices.setdefault(manager.input_device_idx, {})
+                if manager.input_channel in audio_ins:
+                    raise ValueError(f"Receiver {manager.receiver} uses a device channel ({manager.input_channel}) that is already in use")
+                audio_ins[manager.input_channel] = manager.spectrum.audio_in
+        for device_idx, audio_ins in devices.items():
+            start_live_channels(audio_ins, device_idx)
+        if(devices):
+            wait_for_rollover(sigspec.cycle_seconds)
+
+        if(run):
+            self.start()
+
+    def start(self):
+        for manager in self.managers:
+            threading.Thread(target=manager.manage_cycle, daemon=True).start()
+
+    def stop(self):
+        for manager in self.managers:
+            manager.stop()
+
+    def close(self):
+        """stop() every receiver and shut down the decode pool. Call once their manage_cycle threads have returned."""
+        self.stop()
+        self.decode_pool.close()
+
+    @property
+    def wav_finished(self):
+        return all(m.spectrum.audio_in.wav_finished for m in self.managers)
+
+    def stats(self):
+        """Per receiver: decode chunks queued and done, and the worker seconds spent on them."""
+        return self.decode_pool.stats()
@@ -0,0 +1,89 @@
+"""
+Decodes recorded wav files as fast as possible, without the real-time pacing of Cycle_manager.
+"""
+
+import os
+import time
+import wave
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from PyFT8.spectrum import Spectrum
+from PyFT8.sigspecs import FT8
+
+def decode_wav(wav_path, sigspec = FT8, freq_range = [200, 3100], passes = 1):
+    """Decode one cycle-aligned wav file and return the list of decode dicts, one per distinct message."""
+    wf = wave.open(wav_path, "rb")
+    samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    wf.close()
+    cyclestart_str = os.path.splitext(os.path.basename(wav_path))[0]
+    return decode_samples(samples, cyclestart_str, sigspec, freq_range, passes)
+
+def decode_samples(samples, cyclestart_str, sigspec = FT8, freq_range = [200, 3100], passes = 1):
+    """Decode one cycle of 12 kHz samples starting at the cycle boundary. With passes > 1, the signals
+    decoded in each pass are subtracted from the spectrogram and the residual is searched again."""
+    spectrum = Spectrum(sigspec, 12000, freq_range[1], 4, 2)
+    spectrum.audio_in.load_samples(samples)
+    return decode_spectrum(spectrum, cyclestart_str, freq_range, passes)
+
+def decode_spectrogram(dB, cyclestart_str, sigspec = FT8, freq_range = [200, 3100], passes = 1):
+    """Decode one cycle's spectrogram (a dB_main, e.g. from a SpectrogramArchive) without its audio.
+    freq_range[1] must be the maximum frequency the spectrogram was made with."""
+    spectrum = Spectrum(sigspec, 12000, freq_range[1], 4, 2)
+    spectrum.audio_in.dB_main[:] = dB
+    spectrum.audio_in.wav_finished = True
+    return decode_spectrum(spectrum, cyclestart_str, freq_range, passes)
+
+def decode_spectrum(spectrum, cyclestart_str, freq_range, passes = 1):
+    f0_idxs = range(int(freq_range[0]/spectrum.df),
+                    min(spectrum.nFreqs - spectrum.fbins_per_signal, int(freq_range[1]/spectrum.df)))
+    decodes, duplicate_filter = [], set()
+    osd_budget = None
+    for decode_pass in range(passes):
+        candidates, decoded = spectrum.search_and_decode(f0_idxs, cyclestart_str, osd_budget)
+        osd_budget = candidates.osd_budget
+        new_rows = []
+        for row in decoded:
+            dd = candidates.decode_dict(row)
+            if dd['msg'] not in duplicate_filter:
+                duplicate_filter.add(dd['msg'])
+                decodes.append(dd)
+                new_rows.append(row)
+        if not new_rows:
+            break
+        spectrum.subtract_decodes(candidates, new_rows)
+    return decodes
+
+def decode_archive(archive_path, on_decode, freq_range = [200, 3100], passes = 1, cycles = None):
+    """Decode archived cycles (all of them, or those listed by cyclestart_str) in time order, calling on_decode
+    for each decode. Returns (number of cycles, total decodes, elapsed seconds)."""
+    from PyFT8.spectrogram_archive import SpectrogramArchive
+    t0 = time.time()
+    archive = SpectrogramArchive(archive_path)
+    cycles = cycles or archive.cycles()
+    ndecodes = 0
+    for cyclestart_str in cycles:
+        dB = archive.load(cyclestart_str)
+        if dB is None:
+            continue
+        decodes = decode_spectrogram(dB, cyclestart_str, FT8, freq_range, passes)
+        for dd in decodes:
+            on_decode(dd)
+        ndecodes += len(decodes)
+    return len(cycles), ndecodes, time.time() - t0
+
+def find_wav_files(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith('.wav'))
+    return [path]
+
+def decode_wav_files(wav_paths, on_decode, workers = None, freq_range = [200, 3100], passes = 1):
+    """Decode many wav files over a pool of worker processes, calling on_decode for each decode
+    in file order. Returns (number of files, total decodes, elapsed seconds)."""
+    t0 = time.time()
+    ndecodes = 0
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        for decodes in pool.map(decode_wav, wav_paths, [FT8] * len(wav_paths), [freq_range] * len(wav_paths), [passes] * len(wav_paths)):
+            for dd in decodes:
+                on_decode(dd)
+            ndecodes += len(decodes)
+    return len(wav_paths), ndecodes, time.time() - t0
@@ -0,0 +1,75 @@
+"""
+Ordered-statistics decoding (OSD) of the (174, 91) LDPC code, a fallback for candidates that belief
+propagation leaves with a few unsatisfied parity checks. The generator is reduced on the most reliable
+bits of each candidate, the hard decision on those bits is re-encoded, and codewords differing from it in
+up to `order` of those bits are ranked by how much received reliability they contradict. The best few
+are accepted only if their CRC matches.
+"""
+
+import numpy as np
+from PyFT8.FT8_encoder import kGEN
+from PyFT8.FT8_crc import check_crc_batch
+
+# Systematic generator [I | P]: row i is the codeword of message + CRC bit i alone
+GEN = np.hstack((np.eye(91, dtype=np.uint8),
+                 np.array([[(int(row) >> (90 - i)) & 1 for row in kGEN] for i in range(91)], dtype=np.uint8)))
+GEN_PACKED = np.packbits(GEN, axis=1)
+GEN.setflags(write=False)
+GEN_PACKED.setflags(write=False)
+PAIRS = np.triu_indices(91, 1)
+
+def reliability_basis(order):
+    """Gaussian elimination over GF(2) on the packed generator rows, taking pivot columns in the given
+    order (most reliable bit first) and skipping columns that depend on earlier ones.
+    Returns the reduced generator as (91, 174) bits and its 91 pivot columns."""
+    rows = GEN_PACKED.copy()
+    pivots = []
+    for col in order:
+        r = len(pivots)
+        byte, mask = col >> 3, np.uint8(0x80 >> (col & 7))
+        has_bit = (rows[r:, byte] & mask) != 0
+        if not has_bit.any():
+            continue
+        p = r + int(np.argmax(has_bit))
+        rows[[r, p]] = rows[[p, r]]
+        others = (rows[:, byte] & mask) != 0
+        others[r] = False
+        rows[others] ^= rows[r]
+        pivots.append(col)
+        if len(pivots) == 91:
+            break
+    return np.unpackbits(rows, axis=1)[:, :174], np.array(pivots)
+
+def osd_decode(llr, order = 2, max_crc_checks = 8, max_hard_errors = 40):
+    """OSD-0/1/2 on one 174-bit LLR vector (positive = 1). Returns (bits91, hard errors) for the most likely
+    codeword among the max_crc_checks best that passes the CRC, or None."""
+    llr = np.asarray(llr, dtype=np.float64)
+    hard = (llr > 0).astype(np.uint8)
+    w = np.abs(llr)
+    basis, pivots = reliability_basis(np.argsort(-w, kind='stable'))
+    c0 = (hard[pivots].astype(int) @ basis) & 1
+    d0 = c0 ^ hard
+    # Cost of a codeword = sum of |llr| over bits that disagree with the hard decision; flipping basis
+    # rows i (and j) changes it by a_i (+ a_j - 2 * overlap_ij)
+    ws = w * (1 - 2.0 * d0)
+    a = basis @ ws
+    flips_i, flips_j, costs = [np.array([-1])], [np.array([-1])], [np.array([0.0])]
+    if order >= 1:
+        flips_i.append(np.arange(91))
+        flips_j.append(np.full(91, -1))
+        costs.append(a)
+    if order >= 2:
+        overlap = (basis * ws) @ basis.T
+        flips_i.append(PAIRS[0])
+        flips_j.append(PAIRS[1])
+        costs.append(a[PAIRS[0]] + a[PAIRS[1]] - 2 * overlap[PAIRS])
+    flips_i, flips_j, costs = np.concatenate(flips_i), np.concatenate(flips_j), np.concatenate(costs)
+    best = np.argsort(costs, kind='stable')[:max_crc_checks]
+    basis_padded = np.vstack((basis, np.zeros(174, dtype=np.uint8)))
+    codewords = c0[None, :] ^ basis_padded[flips_i[best]] ^ basis_padded[flips_j[best]]
+    hard_errors = np.sum(codewords != hard[None, :], axis=1)
+    ok = check_crc_batch(codewords[:, :91]) & (hard_errors <= max_hard_errors)
+    if not ok.any():
+        return None
+    i = int(np.argmax(ok))
+    return codewords[i, :91].astype(np.uint8), int(hard_errors[i])
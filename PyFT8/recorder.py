@@ -0,0 +1,99 @@
+"""
+Background recorder: AudioIn hands each int16 audio buffer (the callback's own bytes, not a copy) to a
+bounded queue, and a writer thread saves them as one wav file per cycle named by cyclestart_str, the same
+names PyFT8.offline uses, so recordings line up with the decodes made from them.
+"""
+
+import os
+import queue
+import threading
+import time
+import wave
+from PyFT8.metrics import global_metrics
+from PyFT8.time_utils import global_time_utils
+
+class CycleRecorder:
+    def __init__(self, path, sample_rate = 12000, cycle_seconds = 15, max_queue = 256, max_files = None):
+        """Record to wav files in directory path, keeping at most max_files of them (None keeps all).
+        Buffers arriving while max_queue are already waiting are dropped and counted."""
+        self.path = path
+        self.sample_rate = sample_rate
+        self.cycle_seconds = cycle_seconds
+        self.max_files = max_files
+        self.queue = queue.Queue(maxsize = max_queue)
+        self.dropped_buffers = 0
+        self.written_samples = 0
+        self.files = []
+        self.wav = None
+        self.cycle_start = None
+        self.next_sample_time = None
+        os.makedirs(path, exist_ok = True)
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def submit(self, in_data, t_end = None):
+        """Queue one buffer of int16 bytes that finished arriving at t_end (default now). Never blocks."""
+        try:
+            self.queue.put_nowait((in_data, time.time() if t_end is None else t_end))
+        except queue.Full:
+            self.dropped_buffers += 1
+            global_metrics.count('recorder_dropped_buffers', 1)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            self.write(*item)
+        self._close_file()
+
+    def write(self, data, t_end):
+        nsamples = len(data) // 2
+        t_start = t_end - global_time_utils.global_offset - nsamples / self.sample_rate
+        # Follow the buffers' own sample clock, and only re-align to wall time after a gap (e.g. dropped buffers)
+        if self.next_sample_time is None or abs(t_start - self.next_sample_time) > 0.1:
+            self.next_sample_time = t_start
+        t_start = self.next_sample_time
+        while nsamples:
+            cycle_start = self.cycle_seconds * int(t_start // self.cycle_seconds)
+            if cycle_start != self.cycle_start:
+                self._open_file(cycle_start, t_start)
+            n = min(nsamples, max(1, round((cycle_start + self.cycle_seconds - t_start) * self.sample_rate)))
+            self.wav.writeframes(data[:2 * n])
+            data, nsamples = data[2 * n:], nsamples - n
+            self.written_samples += n
+            t_start += n / self.sample_rate
+        self.next_sample_time = t_start
+
+    def _open_file(self, cycle_start, t_start):
+        self._close_file()
+        self.cycle_start = cycle_start
+        cyclestart_str = time.strftime("%y%m%d_%H%M%S", time.gmtime(cycle_start))
+        file = os.path.join(self.path, cyclestart_str + '.wav')
+        self.wav = wave.open(file, 'wb')
+        self.wav.setnchannels(1)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(self.sample_rate)
+        # Pad a recording that starts mid-cycle so that sample 0 is always the cycle start
+        self.wav.writeframes(bytes(2 * round((t_start - cycle_start) * self.sample_rate)))
+        self.files.append(file)
+        global_metrics.count('recorder_files', 1)
+        while self.max_files and len(self.files) > self.max_files:
+            try:
+                os.remove(self.files.pop(0))
+            except OSError:
+                pass
+
+    def _close_file(self):
+        if self.wav is not None:
+            self.wav.close()
+            self.wav = None
+
+    def close(self):
+        """Write out everything queued and close the current file."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'dropped_buffers': self.dropped_buffers,
+                'written_samples': self.written_samples, 'files': len(self.files)}
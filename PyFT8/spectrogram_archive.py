@@ -0,0 +1,97 @@
+"""
+Rotating on-disk archive of past cycles' spectrograms (dB_main), memory-mapped and stored compactly as
+float16 or as uint8 with a per-cycle offset and scale, so that old cycles can be searched and decoded
+again without their audio:
+
+    archive = SpectrogramArchive('spectra', hops_percycle, nFreqs)
+    archive.store(dB_main, cycle_start)                      # cycle_start in (offset) epoch seconds
+    dB = archive.load('250101_120015')
+"""
+
+import json
+import os
+import time
+import numpy as np
+
+INDEX_DTYPE = np.dtype([('cycle_start', '<i8'), ('cyclestart_str', 'S13'), ('offset', '<f4'), ('scale', '<f4')])
+
+class SpectrogramArchive:
+    def __init__(self, path, hops_percycle = None, nFreqs = None, ncycles = None, encoding = None, cycle_seconds = None):
+        """Open the archive in directory path, creating it with the given shape, ncycles (default 240), encoding
+        (default uint8) and cycle_seconds (default 15) if it doesn't exist. An archive holds ncycles cycles; each new
+        cycle replaces the one ncycles * cycle_seconds earlier. Raises ValueError if an existing archive's shape,
+        ncycles, encoding or cycle_seconds differs from any that are given."""
+        self.path = path
+        meta_file = os.path.join(path, 'archive.json')
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                meta = json.load(f)
+            for name, value in (('hops_percycle', hops_percycle), ('nFreqs', nFreqs), ('ncycles', ncycles),
+                                ('encoding', encoding), ('cycle_seconds', cycle_seconds)):
+                if value is not None and meta[name] != value:
+                    raise ValueError(f"Archive {path} has {name} {meta[name]}, not {value}")
+            mode = 'r+'
+        else:
+            encoding = encoding or 'uint8'
+            ncycles, cycle_seconds = ncycles or 240, cycle_seconds or 15
+            if encoding not in ('uint8', 'float16'):
+                raise ValueError(f"Unknown spectrogram encoding {encoding}")
+            meta = {'hops_percycle': hops_percycle, 'nFreqs': nFreqs, 'ncycles': ncycles,
+                    'encoding': encoding, 'cycle_seconds': cycle_seconds}
+            os.makedirs(path, exist_ok = True)
+            with open(meta_file, 'w') as f:
+                json.dump(meta, f)
+            mode = 'w+'
+        self.meta = meta
+        self.ncycles, self.cycle_seconds = meta['ncycles'], meta['cycle_seconds']
+        self.shape = (meta['hops_percycle'], meta['nFreqs'])
+        self.data = np.memmap(os.path.join(path, 'spectra.dat'), dtype = meta['encoding'], mode = mode,
+                              shape = (self.ncycles,) + self.shape)
+        self.index = np.memmap(os.path.join(path, 'index.dat'), dtype = INDEX_DTYPE, mode = mode, shape = (self.ncycles,))
+        if mode == 'w+':
+            self.index['cycle_start'] = -1
+
+    def _slot(self, cycle_start):
+        return (int(cycle_start) // self.cycle_seconds) % self.ncycles
+
+    def store(self, dB, cycle_start):
+        """Archive one cycle's spectrogram, replacing the oldest cycle in its slot."""
+        cycle_start = self.cycle_seconds * (int(cycle_start) // self.cycle_seconds)
+        slot = self._slot(cycle_start)
+        self.index['cycle_start'][slot] = -1
+        dB = np.asarray(dB, dtype = np.float32)
+        if self.data.dtype == np.uint8:
+            offset = float(np.floor(np.min(dB)))
+            scale = max(float(np.max(dB)) - offset, 1e-3) / 255
+            self.data[slot] = np.rint((dB - offset) / scale).astype(np.uint8)
+        else:
+            offset, scale = 0.0, 1.0
+            self.data[slot] = dB
+        cyclestart_str = time.strftime("%y%m%d_%H%M%S", time.gmtime(cycle_start))
+        self.index[slot] = (cycle_start, cyclestart_str.encode(), offset, scale)
+        return cyclestart_str
+
+    def flush(self):
+        self.data.flush()
+        self.index.flush()
+
+    def cycles(self):
+        """cyclestart_str of every archived cycle, oldest first."""
+        valid = self.index[self.index['cycle_start'] >= 0]
+        return [s.decode() for s in valid[np.argsort(valid['cycle_start'])]['cyclestart_str']]
+
+    def find(self, cycle):
+        """Slot of a cycle given as cyclestart_str or epoch seconds, or None if it is not archived."""
+        if isinstance(cycle, str):
+            slots = np.flatnonzero((self.index['cyclestart_str'] == cycle.encode()) & (self.index['cycle_start'] >= 0))
+            return int(slots[0]) if len(slots) else None
+        slot = self._slot(cycle)
+        return slot if self.index['cycle_start'][slot] == self.cycle_seconds * (int(cycle) // self.cycle_seconds) else None
+
+    def load(self, cycle):
+        """The archived spectrogram of a cycle as float32 dB, or None."""
+        slot = self.find(cycle)
+        if slot is None:
+            return None
+        entry = self.index[slot]
+        return self.data[slot].astype(np.float32) * entry['scale'] + entry['offset']
@@ -2,12 +2,21 @@
 import numpy as np
 import time
 from PyFT8.audio import find_device, AudioIn
-from PyFT8.candidate import Candidate
+from PyFT8.candidate import CandidateTable
+from PyFT8.FT8_encoder import encode_bits77
+from PyFT8.metrics import global_metrics
+
+params = {
+'SYNC_MIN_SCORE': 0,         # candidates with a lower sync score are not decoded
+'SYNC_PEAK_TONES': 1,        # a sync peak must be the best score within this many tone spacings either side
+'MAX_CANDIDATES': 200,       # top K candidates by sync score kept per search
+}
 
 class Spectrum:
     def __init__(self, sigspec, sample_rate, max_freq, hops_persymb, fbins_pertone):
         self.sigspec = sigspec
         self.sample_rate = sample_rate
+        self.max_freq = max_freq
         self.fbins_pertone = fbins_pertone
         self.hops_persymb = hops_persymb
         self.hops_percycle = int(self.sigspec.cycle_seconds * self.sigspec.symbols_persec * self.hops_persymb)
@@ -34,43 +43,103 @@ class Spectrum:
             csync[sym_idx, sigspec.costas_len*self.fbins_pertone:] = 0
         return csync.ravel()
 
-    def get_sync(self, f0_idx, dB, sync_idx):
-        best_sync = {'h0_idx':0, 'score':0, 'dt': 0}
-        for h0_idx in self.search_hops_range:
-            sync_score = float(np.dot(dB[h0_idx + self.hop_idxs_Costas + sync_idx * 36 * self.hops_persymb ,  :].ravel(), self.csync_flat))
-            test_sync = {'h0_idx':h0_idx, 'score':sync_score, 'dt': h0_idx * self.dt - 0.7}
-            if test_sync['score'] > best_sync['score']:
-                best_sync = test_sync
-        return best_sync
-    
-    def search(self, f0_idxs, cyclestart_str):
-        cands = []
-        dB_main = self.audio_in.dB_main
-        hps, bpt = self.hops_persymb, self.fbins_pertone
-        for f0_idx in f0_idxs:
-            dB = dB_main[:, f0_idx:f0_idx + self.fbins_per_signal]
-            dB = dB - np.max(dB)
-            c = Candidate()
-            c.f0_idx = f0_idx
-            sync_idx = 1
-            c.sync = self.get_sync(f0_idx, dB, sync_idx)
-            c.freq_idxs = [c.f0_idx + bpt // 2 + bpt * t for t in range(self.sigspec.tones_persymb)]
-            c.last_payload_hop = c.sync['h0_idx'] + hps * 72
-            c.cyclestart_str = cyclestart_str
-            c.decode_dict = {'decoder': 'PyFT8',
-                             'cs':c.cyclestart_str,
-                             'f':int((c.f0_idx + bpt // 2) * self.df),
-                             'f0_idx': c.f0_idx,
-                             'sync_idx': sync_idx, 
-                             'sync': c.sync,
-                             'dt': int(0.5+100*c.sync['dt'])/100.0, 
-                             'ncheck0': 99,
-                             'snr': -30,
-                             'llr_sd':0,
-                             'decode_path':'',
-                             'msg_tuple':(''), 'msg':'',
-                             'td': 0}
-            cands.append(c)
-        return cands
+    def get_sync_all(self, f0_idxs, dB_main, sync_idx):
+        # Scores every (h0_idx, f0_idx) pair in one pass as a 2-D correlation of dB_main with the Costas template.
+        # Equivalent, for each f0_idx, to the best over h0_idx of the dot product of csync_flat with the Costas
+        # hops of dB = dB_main[:, f0:f0+fbins_per_signal] - max(dB)
+        f0_idxs = np.asarray(f0_idxs, dtype=int)
+        f_lo, f_hi = int(f0_idxs.min()), int(f0_idxs.max()) + 1
+        nsig = self.fbins_per_signal
+        h0_idxs = np.array(self.search_hops_range)
+        csync = self.csync_flat.reshape(-1, nsig)
+        rows = h0_idxs[:, None] + self.hop_idxs_Costas[None, :] + sync_idx * 36 * self.hops_persymb
+        block = dB_main[rows, f_lo:f_hi + nsig - 1]
+        scores = np.zeros((len(h0_idxs), f_hi - f_lo), dtype=np.float32)
+        for k, j in zip(*np.nonzero(csync)):
+            scores += csync[k, j] * block[:, k, j:j + f_hi - f_lo]
+        fmax = np.lib.stride_tricks.sliding_window_view(np.max(dB_main[:, f_lo:f_hi + nsig - 1], axis=0), nsig).max(axis=1)
+        scores -= np.sum(self.csync_flat) * fmax
+        scores = scores[:, f0_idxs - f_lo]
+        best = np.argmax(scores, axis=0)
+        best_score = scores[best, np.arange(len(f0_idxs))]
+        found = best_score > 0
+        best_h0 = np.where(found, h0_idxs[best], 0)
+        return best_h0, np.where(found, best_score, 0), np.where(found, best_h0 * self.dt - 0.7, 0)
+
+    def select_candidates(self, scores):
+        """Peak-pick sync scores (one per f0_idx, in frequency order): keep only local maxima within
+        SYNC_PEAK_TONES, at or above SYNC_MIN_SCORE, and at most the MAX_CANDIDATES best of those, each
+        with the bins either side of it. Returns their indices into scores."""
+        d = max(int(params['SYNC_PEAK_TONES'] * self.fbins_pertone), 1)
+        padded = np.pad(scores, d, constant_values = -np.inf)
+        local_max = np.lib.stride_tricks.sliding_window_view(padded, 2 * d + 1).max(axis=1)
+        keep = np.flatnonzero((scores >= local_max) & (scores >= params['SYNC_MIN_SCORE']) & (scores > 0))
+        keep = keep[np.argsort(-scores[keep], kind='stable')][:params['MAX_CANDIDATES']]
+        # The sync peak can be a bin away from the f0 that demaps best (for strong signals, the peak
+        # bin often fails to decode), so its neighbours are candidates too
+        keep = np.unique(np.concatenate((keep - 1, keep, keep + 1)))
+        keep = keep[(keep >= 0) & (keep < len(scores))]
+        return keep[scores[keep] > 0]
+
+    def tone_freq_idxs(self, f0_idx):
+        bpt = self.fbins_pertone
+        return [f0_idx + bpt // 2 + bpt * t for t in range(self.sigspec.tones_persymb)]
 
+    def subtract_signal(self, f0_idx, h0_idx, symbols, noise, max_hop = None):
+        """Subtract a decoded signal's estimated power from dB_main. Each symbol owns the hops
+        h0_idx + hops_persymb * k - 1 ... + 2; the signal's power profile over those hops and a few bins
+        either side of its tone is averaged over all 79 symbols and removed, never going below the noise.
+        Symbols reaching max_hop or beyond (not yet written in this cycle) are left alone."""
+        hop_offsets = np.arange(-1, self.hops_persymb - 1)
+        bin_offsets = np.arange(-self.fbins_pertone - 1, self.fbins_pertone + 2)
+        hops = h0_idx + self.hops_persymb * np.arange(len(symbols))[:, None] + hop_offsets[None, :]
+        bins = np.array([self.tone_freq_idxs(f0_idx)[s] for s in symbols])[:, None] + bin_offsets[None, :]
+        valid = np.all((hops >= 0) & (hops < (self.hops_percycle if max_hop is None else max_hop)), axis=1)
+        valid &= np.all((bins >= 0) & (bins < self.nFreqs), axis=1)
+        hops, bins = hops[valid][:, :, None], bins[valid][:, None, :]
+        p = 10**(self.audio_in.dB_main[hops, bins] / 10)
+        floor = noise[bins]
+        profile = np.mean(np.maximum(p - floor, 0), axis=0)
+        p_res = np.maximum(p - profile, np.minimum(p, floor))
+        self.audio_in.dB_main[hops, bins] = 10*np.log10(p_res)
+
+    def subtract_decodes(self, table, rows, max_hop = None):
+        """Subtract the given decoded rows of a CandidateTable from dB_main, re-encoding each message.
+        Only hops below max_hop are used, when it is given."""
+        noise = np.median(10**(self.audio_in.dB_main[:max_hop] / 10), axis=0)
+        for row in rows:
+            symbols = encode_bits77(table.decodes[row][3])[0]
+            self.subtract_signal(int(table.f0_idx[row]), int(table.h0_idx[row]), symbols, noise, max_hop)
+
+    def search(self, f0_idxs, cyclestart_str):
+        sync_idx = 1
+        with global_metrics.timer('sync_search'):
+            best_h0, best_score, best_dt = self.get_sync_all(f0_idxs, self.audio_in.dB_main, sync_idx)
+            keep = self.select_candidates(best_score)
+        global_metrics.count('candidates_searched', len(keep))
+        return CandidateTable(self, np.asarray(f0_idxs)[keep], best_h0[keep], best_score[keep], cyclestart_str, sync_idx)
 
+    def search_and_decode(self, f0_idxs, cyclestart_str, osd_budget = None, deadline = None, chunk = 25, max_hop = None):
+        """Search, demap and decode every candidate straight away, for a spectrogram whose frame is complete
+        (or, with max_hop, only the candidates whose payload ends below max_hop).
+        With a deadline (time.time() value), candidates are decoded in chunks, strongest sync first, and those
+        not reached by the deadline are left undecoded. Returns the CandidateTable and the rows that decoded."""
+        table = self.search(f0_idxs, cyclestart_str)
+        if osd_budget is not None:
+            table.osd_budget = osd_budget
+        rows = np.arange(len(table))
+        if max_hop is not None:
+            rows = rows[table.last_payload_hop < max_hop]
+        if deadline is None:
+            table.demap(rows)
+            return table, table.decode(rows[table.llr_sd[rows] > 0])
+        rows = rows[np.argsort(-table.score[rows], kind='stable')]
+        decoded = []
+        for i in range(0, len(rows), chunk):
+            if time.time() >= deadline:
+                global_metrics.count('deadline_skipped', len(rows) - i)
+                break
+            table.demap(rows[i:i + chunk])
+            ready = rows[i:i + chunk][table.llr_sd[rows[i:i + chunk]] > 0]
+            decoded += table.decode(ready, deadline).tolist()
+        return table, np.array(decoded, dtype=int)
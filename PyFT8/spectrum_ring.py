@@ -0,0 +1,107 @@
+"""
+Sequence-numbered ring of recent spectrum rows, written by AudioIn as each hop is transformed and read
+without locks by viewers, in the same process or (via shared memory) in another one.
+
+Each slot carries a sequence number: 2n + 1 while row n is being written and 2n + 2 once it is complete.
+A reader copies a slot and accepts the copy only if the sequence number was 2n + 2 both before and after,
+so it never sees a torn row and never blocks the writer.
+
+    ring = SpectrumRing.attach('pyft8_spectrum')    # in a viewer process
+    rows, seen = ring.read_since(seen)
+"""
+
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+HEADER_LEN = 4      # published rows, slots, row length, bin spacing in micro-Hz
+
+def _open_shared(shm_name):
+    # Attach without letting this process's resource tracker unlink the block when it exits
+    try:
+        return shared_memory.SharedMemory(name = shm_name, track = False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name = shm_name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+def _create_shared(shm_name, nbytes):
+    try:
+        return shared_memory.SharedMemory(name = shm_name, create = True, size = nbytes)
+    except FileExistsError:
+        # Left behind by a receiver that didn't exit cleanly: replace it
+        stale = shared_memory.SharedMemory(name = shm_name)
+        stale.close()
+        stale.unlink()
+        return shared_memory.SharedMemory(name = shm_name, create = True, size = nbytes)
+
+class SpectrumRing:
+    def __init__(self, nslots, row_len, shm_name = None, df = 0.0, _attach = False):
+        nbytes = 8 * (HEADER_LEN + nslots) + 4 * nslots * row_len
+        self.shm = None
+        if shm_name:
+            self.shm = _open_shared(shm_name) if _attach else _create_shared(shm_name, nbytes)
+            buf = self.shm.buf
+        else:
+            buf = bytearray(nbytes)
+        self.header = np.ndarray(HEADER_LEN, dtype = np.int64, buffer = buf)
+        self.seq = np.ndarray(nslots, dtype = np.int64, buffer = buf, offset = 8 * HEADER_LEN)
+        self.rows = np.ndarray((nslots, row_len), dtype = np.float32, buffer = buf, offset = 8 * (HEADER_LEN + nslots))
+        self.nslots, self.row_len = nslots, row_len
+        self.owner = not _attach
+        if self.owner:
+            self.header[:] = (0, nslots, row_len, round(df * 1e6))
+            self.seq[:] = 0
+
+    @classmethod
+    def attach(cls, shm_name):
+        """Open a ring published in shared memory by another process."""
+        shm = _open_shared(shm_name)
+        nslots, row_len = (int(v) for v in np.ndarray(HEADER_LEN, dtype = np.int64, buffer = shm.buf)[1:3])
+        shm.close()
+        return cls(nslots, row_len, shm_name, _attach = True)
+
+    @property
+    def published(self):
+        return int(self.header[0])
+
+    @property
+    def df(self):
+        return self.header[3] / 1e6
+
+    def publish(self, rows):
+        """Append rows (an (n, row_len) array) to the ring. Single writer only."""
+        n = int(self.header[0])
+        for row in rows:
+            slot = n % self.nslots
+            self.seq[slot] = 2 * n + 1
+            self.rows[slot] = row
+            self.seq[slot] = 2 * n + 2
+            n += 1
+            self.header[0] = n
+
+    def read(self, n):
+        """Row number n, or None if it has not been published yet or has already been overwritten."""
+        slot = n % self.nslots
+        seq = self.seq[slot]
+        if seq != 2 * n + 2:
+            return None
+        row = self.rows[slot].copy()
+        return row if self.seq[slot] == seq else None
+
+    def read_since(self, seen, max_rows = None):
+        """The rows published after the first `seen`, oldest first (at most max_rows, the most recent), and the
+        new value of seen. Rows overwritten before they could be read are left out."""
+        published = self.published
+        first = max(seen, published - self.nslots + 1, published - (max_rows or self.nslots))
+        rows = [row for row in (self.read(n) for n in range(first, published)) if row is not None]
+        return (np.array(rows) if rows else np.zeros((0, self.row_len), dtype = np.float32)), published
+
+    def close(self):
+        """Release the shared memory, unlinking it if this ring created it."""
+        if self.shm is None:
+            return
+        self.header = self.seq = self.rows = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
@@ -13,7 +13,10 @@ import numpy as np
 import pyaudio
 
 from PyFT8.cycle_manager import Cycle_manager
+from PyFT8.decode_log import DecodeLog
+from PyFT8.metrics import global_metrics
 from PyFT8.sigspecs import FT8
+from PyFT8.spectrum_ring import SpectrumRing
 from PyFT8.time_utils import global_time_utils
 
 
@@ -27,10 +30,12 @@ class DecodeLine:
 
 
 class SharedState:
-    def __init__(self, max_msgs: int = 50):
+    def __init__(self, max_msgs: int = 50, waterfall_rows: int = 200):
         self.lock = threading.Lock()
         self.decoded: Deque[DecodeLine] = deque(maxlen=max_msgs)
-        self.last_spectrum: Optional[np.ndarray] = None
+        self.decodes_seq: int = 0
+        self.waterfall: Deque[np.ndarray] = deque(maxlen=waterfall_rows)  # newest first
+        self.waterfall_seq: int = 0
         self.last_update: float = 0.0
         self.n_unfinished: int = 0
 
@@ -51,8 +56,10 @@ def parse_device_keywords(arg: Optional[str]) -> Optional[List[str]]:
     return [s.strip() for s in arg.split(",") if s.strip()]
 
 
-def make_on_decode(state: SharedState):
+def make_on_decode(state: SharedState, decode_log: Optional[DecodeLog] = None):
     def _on_decode(d: dict) -> None:
+        if decode_log is not None:
+            decode_log.on_decode(d)
         with state.lock:
             state.decoded.appendleft(
                 DecodeLine(
@@ -63,6 +70,7 @@ def make_on_decode(state: SharedState):
                     msg=d.get("msg", ""),
                 )
             )
+            state.decodes_seq += 1
     return _on_decode
 
 
@@ -73,130 +81,139 @@ def make_on_finished(state: SharedState):
     return _on_finished
 
 
-def sample_spectrum(cm: Cycle_manager, state: SharedState) -> None:
-    """Periodically sample the latest spectrum slice for display."""
-    audio_in = cm.spectrum.audio_in
+def sample_spectrum(ring: SpectrumRing, state: SharedState, interval: float) -> None:
+    """Every interval seconds, add the peak over the rows published since the last sample as a waterfall row."""
+    seen = ring.published
     while True:
-        time.sleep(0.05)
-        ptr = audio_in.main_ptr - 1
-        if ptr < 0:
-            ptr = audio_in.hops_percycle - 1
-        row = audio_in.dB_main[ptr].copy()
+        time.sleep(interval)
+        rows, seen = ring.read_since(seen)
+        if not len(rows):
+            continue
+        row = np.max(rows, axis=0)
         with state.lock:
-            state.last_spectrum = row
+            state.waterfall.appendleft(row)
+            state.waterfall_seq += 1
             state.last_update = time.time()
 
 
-def render_spectrum(
-    win,
-    spectrum: np.ndarray,
-    fmin: int,
-    fmax: int,
-    df: float,
-    width: int,
-    palette: str,
-) -> str:
-    fbin_min = int(fmin / df)
-    fbin_max = int(fmax / df)
-    fbin_max = min(fbin_max, spectrum.shape[0] - 1)
-    fbin_min = max(fbin_min, 0)
-    band = spectrum[fbin_min:fbin_max]
-    if band.size <= 0:
-        return "".ljust(width)
-
-    # Downsample to terminal width
-    bins_per_col = max(1, int(np.ceil(band.size / width)))
-    cols = []
-    for i in range(0, band.size, bins_per_col):
-        slice_ = band[i : i + bins_per_col]
-        cols.append(float(np.mean(slice_)))
-    cols = np.array(cols[:width])
-
-    # Normalize to [0, 1]
+class ColumnMap:
+    """Bin-to-column map for one terminal width: column i averages spectrum bins starts[i] to starts[i+1] - 1,
+    computed for a whole row with one np.add.reduceat."""
+
+    def __init__(self, fmin: int, fmax: int, df: float, nfreqs: int, width: int):
+        self.width = width
+        # At least one bin, even for a range narrower than a bin or outside the spectrum
+        fbin_min = min(max(int(fmin / df), 0), nfreqs - 2)
+        self.fbin_max = max(min(int(fmax / df), nfreqs - 1), fbin_min + 1)
+        ncols = max(1, min(width, self.fbin_max - fbin_min))
+        self.starts = fbin_min + (np.arange(ncols) * (self.fbin_max - fbin_min)) // ncols
+        self.counts = np.maximum(np.diff(np.append(self.starts, self.fbin_max)), 1)
+
+    def columns(self, spectrum: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(spectrum[: self.fbin_max], self.starts) / self.counts
+
+
+def render_spectrum(spectrum: np.ndarray, column_map: ColumnMap, palette: np.ndarray) -> str:
     low, high = -120.0, -20.0
-    levels = np.clip((cols - low) / (high - low), 0.0, 1.0)
+    levels = np.clip((column_map.columns(spectrum) - low) / (high - low), 0.0, 1.0)
     idxs = (levels * (len(palette) - 1)).astype(int)
-    line = "".join(palette[i] for i in idxs)
-    return line.ljust(width)
+    return "".join(palette[idxs]).ljust(column_map.width)
+
+
+class Screen:
+    """Writes rows through a cache of what is on screen, so unchanged rows cost nothing to redraw."""
+
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.rows = {}
+
+    def reset(self) -> None:
+        self.rows = {}
+        self.stdscr.clear()
+
+    def put(self, row: int, text: str) -> None:
+        h, w = self.stdscr.getmaxyx()
+        if row >= h or w < 2:
+            return
+        text = text[: w - 1].ljust(w - 1)
+        if self.rows.get(row) == text:
+            return
+        self.rows[row] = text
+        try:
+            self.stdscr.addnstr(row, 0, text, w - 1)
+        except curses.error:
+            pass
 
 
-def draw_tui(stdscr, cm: Cycle_manager, state: SharedState, fmin: int, fmax: int) -> None:
+def draw_tui(stdscr, ring: SpectrumRing, state: SharedState, fmin: int, fmax: int, waterfall_rows: int) -> None:
     curses.curs_set(0)
     stdscr.nodelay(True)
     stdscr.timeout(100)
+    stdscr.idlok(True)
 
-    palette = " .:-=+*#%@"
+    palette = np.array(list(" .:-=+*#%@"))
+    screen = Screen(stdscr)
+    size = None
+    column_map = None
+    waterfall_seq = decodes_seq = -1
+    wf_top = 3
 
     while True:
         h, w = stdscr.getmaxyx()
-        stdscr.erase()
+        if (h, w) != size:
+            size = (h, w)
+            screen.reset()
+            column_map = ColumnMap(fmin, fmax, ring.df, ring.row_len, w - 1)
+            # none in a terminal too small for a scrolling region, leaving rows (below) always empty
+            wf_rows = max(0, min(waterfall_rows, (h - wf_top - 4) // 2))
+            waterfall_seq = decodes_seq = -1
+        decodes_top = wf_top + wf_rows + 1
 
-        # Header
         cycle_time = global_time_utils.cycle_time(FT8.cycle_seconds)
-        if h >= 2 and w >= 2:
-            try:
-                stdscr.addnstr(0, 0, "FT8 Decoder (real-time)".ljust(w), w - 1)
-                stdscr.addnstr(1, 0, f"Cycle: {cycle_time:5.2f}s   Freq: {fmin}-{fmax} Hz".ljust(w), w - 1)
-            except curses.error:
-                pass
-
-        # Spectrum line
+        screen.put(0, "FT8 Decoder (real-time)")
+        screen.put(1, f"Cycle: {cycle_time:5.2f}s   Freq: {fmin}-{fmax} Hz")
+
         with state.lock:
-            spectrum = state.last_spectrum
+            new_rows = state.waterfall_seq - waterfall_seq
+            rows = list(state.waterfall)[: min(new_rows, wf_rows)] if new_rows > 0 else []
+            waterfall_seq = state.waterfall_seq
+            have_data = bool(state.waterfall)
             n_unfinished = state.n_unfinished
-        if spectrum is not None:
-            line = render_spectrum(
-                stdscr,
-                spectrum,
-                fmin,
-                fmax,
-                cm.spectrum.df,
-                w,
-                palette,
-            )
-            if h > 3 and w > 1:
-                try:
-                    stdscr.addnstr(3, 0, line, w - 1)
-                    stdscr.addnstr(2, 0, f"Spectrum (dB) — unfinished candidates: {n_unfinished}".ljust(w), w - 1)
-                except curses.error:
-                    pass
+        if not have_data:
+            screen.put(2, "Waterfall: waiting for data...")
         else:
-            if h > 2 and w > 1:
-                try:
-                    stdscr.addnstr(2, 0, "Spectrum: waiting for data...".ljust(w), w - 1)
-                except curses.error:
-                    pass
-
-        # Decoded messages
-        start_row = 5
-        if h > start_row and w > 1:
-            try:
-                stdscr.addnstr(start_row, 0, "Recent decodes:".ljust(w), w - 1)
-            except curses.error:
-                pass
-        header = "UTC        Freq  SNR  dt   Message"
-        if h > start_row + 1 and w > 1:
-            try:
-                stdscr.addnstr(start_row + 1, 0, header.ljust(w), w - 1)
-            except curses.error:
-                pass
+            screen.put(2, f"Waterfall (dB) — unfinished candidates: {n_unfinished}")
+        if rows:
+            # Scroll the rows already drawn down by the number of new ones (the terminal moves them itself when
+            # it can), then draw only the new rows at the top
+            if len(rows) < wf_rows:
+                stdscr.setscrreg(wf_top, wf_top + wf_rows - 1)
+                stdscr.scrollok(True)
+                stdscr.scroll(-len(rows))
+                stdscr.scrollok(False)
+                stdscr.setscrreg(0, h - 1)
+                for r in range(wf_top + wf_rows - 1, wf_top + len(rows) - 1, -1):
+                    screen.rows[r] = screen.rows.get(r - len(rows))
+            for i, spectrum in enumerate(rows):
+                screen.rows.pop(wf_top + i, None)
+                screen.put(wf_top + i, render_spectrum(spectrum, column_map, palette))
+
         with state.lock:
-            decoded_list = list(state.decoded)
-        max_rows = h - (start_row + 2) - 1
-        for i, line in enumerate(decoded_list[:max_rows]):
-            row = start_row + 2 + i
-            msg = f"{line.ts} {line.freq:5d} {line.snr:4d} {line.dt:4.1f} {line.msg}"
-            if h > row and w > 1:
-                try:
-                    stdscr.addnstr(row, 0, msg, w - 1)
-                except curses.error:
-                    pass
-
-        if h > 0 and w > 1:
-            try:
-                stdscr.addnstr(h - 1, 0, "Press q to quit".ljust(w), w - 1)
-            except curses.error:
-                pass
+            changed = state.decodes_seq != decodes_seq
+            decodes_seq = state.decodes_seq
+            decoded_list = list(state.decoded) if changed else []
+        if changed:
+            screen.put(decodes_top, "Recent decodes:")
+            screen.put(decodes_top + 1, "UTC        Freq  SNR  dt   Message")
+            max_rows = h - (decodes_top + 2) - 1
+            for i in range(max(max_rows, 0)):
+                if i < len(decoded_list):
+                    line = decoded_list[i]
+                    screen.put(decodes_top + 2 + i, f"{line.ts} {line.freq:5d} {line.snr:4d} {line.dt:4.1f} {line.msg}")
+                else:
+                    screen.put(decodes_top + 2 + i, "")
+
+        screen.put(h - 1, f"Press q to quit   {global_metrics.status_line()}")
         stdscr.refresh()
 
         try:
@@ -213,36 +230,51 @@ def main() -> None:
     parser.add_argument("--list-devices", action="store_true", help="List audio input devices and exit")
     parser.add_argument("--fmin", type=int, default=200, help="Minimum frequency (Hz)")
     parser.add_argument("--fmax", type=int, default=3100, help="Maximum frequency (Hz)")
+    parser.add_argument("--waterfall-rows", type=int, default=12, help="Maximum waterfall height (rows)")
+    parser.add_argument("--waterfall-interval", type=float, default=0.5, help="Seconds per waterfall row")
+    parser.add_argument("--spectrum-shm", help="Publish the spectrum to a shared memory ring with this name, for other viewers")
+    parser.add_argument("--view", metavar="NAME", help="Only show the waterfall of a receiver publishing to shared memory ring NAME")
+    parser.add_argument("--all-txt", help="Append decodes to this file in WSJT-X ALL.TXT format")
+    parser.add_argument("--db", help="Insert decodes into this SQLite database")
+    parser.add_argument("--metrics-file", help="Write Prometheus metrics to this file after each cycle")
     args = parser.parse_args()
+    if args.fmin >= args.fmax:
+        parser.error("--fmin must be below --fmax")
 
     if args.list_devices:
         list_devices()
         return
 
     state = SharedState(max_msgs=80)
-    device_keywords = parse_device_keywords(args.device)
+    if args.view:
+        ring = SpectrumRing.attach(args.view)
+        threading.Thread(target=sample_spectrum, args=(ring, state, args.waterfall_interval), daemon=True).start()
+        curses.wrapper(draw_tui, ring, state, args.fmin, args.fmax, args.waterfall_rows)
+        return
 
+    device_keywords = parse_device_keywords(args.device)
+    decode_log = DecodeLog(args.all_txt, db=args.db) if (args.all_txt or args.db) else None
     cm = Cycle_manager(
         FT8,
-        on_decode=make_on_decode(state),
+        on_decode=make_on_decode(state, decode_log),
         on_finished=make_on_finished(state),
         input_device_keywords=device_keywords,
         freq_range=[args.fmin, args.fmax],
         verbose=False,
+        metrics_file=args.metrics_file,
+        spectrum_shm=args.spectrum_shm,
     )
+    ring = cm.spectrum.audio_in.enable_spectrum_ring(cm.spectrum.df)
 
-    sampler = threading.Thread(target=sample_spectrum, args=(cm, state), daemon=True)
+    sampler = threading.Thread(target=sample_spectrum, args=(ring, state, args.waterfall_interval), daemon=True)
     sampler.start()
 
     try:
-        curses.wrapper(draw_tui, cm, state, args.fmin, args.fmax)
+        curses.wrapper(draw_tui, ring, state, args.fmin, args.fmax, args.waterfall_rows)
     finally:
-        if hasattr(cm.spectrum.audio_in, "stream"):
-            try:
-                cm.spectrum.audio_in.stream.stop_stream()
-                cm.spectrum.audio_in.stream.close()
-            except Exception:
-                pass
+        cm.stop()
+        if decode_log is not None:
+            decode_log.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""Asynchronous CAT engine for the FX-1, with a pty-based mock radio.
+
+Replies are framed incrementally on ';' as bytes arrive. Queries are pipelined: several can be on the wire at
+once, each reply resolving the oldest outstanding query with the same command prefix. Set commands, which the
+radio only answers if it rejects them ('?;'), are tracked in order too, so that a rejection is matched to the
+command it rejects. Writes are rate limited, polling skips commands whose previous query is still outstanding,
+and every reply (polled, queried or sent unprompted by the radio) updates a typed cache of rig state.
+
+    cat = await CatClient.open("/dev/tty.usbmodem00000000000011")
+    await cat.query("FA")               # -> 14074000, also in cat.state.freq_a
+    await cat.set_frequency(7074000)
+    cat.start_polling(("FA", "MD0"), interval=0.5)
+
+Run with --mock to talk to a simulated FX-1, and --bench to compare sequential and pipelined queries.
+"""
+
+import argparse
+import asyncio
+import os
+import queue
+import random
+import threading
+import time
+import tty
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from fx1_status import DEFAULT_PORTS, MODE_CODES, open_serial
+
+MODE_NAMES = {code: name for name, code in MODE_CODES.items()}
+
+
+class CatError(Exception):
+    pass
+
+
+class CatFramer:
+    """Splits a byte stream into ';'-terminated CAT replies, keeping any partial reply for the next feed."""
+
+    def __init__(self, max_len: int = 256):
+        self.buf = bytearray()
+        self.max_len = max_len
+        self.discarded = 0
+
+    def feed(self, data: bytes) -> List[str]:
+        self.buf.extend(data)
+        end = self.buf.rfind(b";")
+        if end == -1:
+            if len(self.buf) > self.max_len:
+                self.discarded += len(self.buf)
+                self.buf.clear()
+            return []
+        frames = self.buf[:end].split(b";")
+        del self.buf[: end + 1]
+        replies = []
+        for frame in frames:
+            # Line noise (NULs, bytes from a baud rate mismatch) is not part of any reply
+            text = bytes(b for b in frame if 32 < b < 127).decode("ascii")
+            if text:
+                replies.append(text)
+        return replies
+
+
+def command_key(text: str) -> str:
+    """The part of a command or reply that identifies what it is about: MD0 (main VFO mode) vs MD1, else the
+    two-letter command."""
+    if text[:2] in ("MD", "SM") and len(text) > 2:
+        return text[:3]
+    return text[:2]
+
+
+def parse_reply(text: str):
+    """The typed value carried by a reply, or the raw parameter string for commands without a parser."""
+    key, value = command_key(text), text[len(command_key(text)):]
+    if key in ("FA", "FB"):
+        return int(value)
+    if key in ("MD0", "MD1"):
+        return MODE_NAMES.get(value, value)
+    if key in ("SM0", "SM1"):
+        return int(value)
+    if key == "TX":
+        return value != "0"
+    return value
+
+
+@dataclass
+class RigState:
+    freq_a: Optional[int] = None
+    freq_b: Optional[int] = None
+    mode_main: Optional[str] = None
+    mode_sub: Optional[str] = None
+    smeter: Optional[int] = None
+    transmitting: Optional[bool] = None
+    other: Dict[str, str] = field(default_factory=dict)
+    updated: Dict[str, float] = field(default_factory=dict)
+
+    FIELDS = {"FA": "freq_a", "FB": "freq_b", "MD0": "mode_main", "MD1": "mode_sub", "SM0": "smeter", "TX": "transmitting"}
+
+    def update(self, key: str, value) -> bool:
+        """Store a reply's value; True if it changed."""
+        self.updated[key] = time.time()
+        name = self.FIELDS.get(key)
+        old = getattr(self, name) if name else self.other.get(key)
+        if name:
+            setattr(self, name, value)
+        else:
+            self.other[key] = value
+        return old != value
+
+
+class CatClient:
+    def __init__(self, fd: int, max_in_flight: int = 4, max_rate: float = 100.0, timeout: float = 1.0, serial=None):
+        """CAT client on an open, configured file descriptor. At most max_in_flight queries are outstanding
+        and at most max_rate commands per second are written."""
+        self.fd = fd
+        self.serial = serial
+        self.loop = asyncio.get_running_loop()
+        self.framer = CatFramer()
+        self.state = RigState()
+        # Commands on the wire, oldest first, as (key, future, time written); set commands have no future
+        self.pending: Deque[Tuple[str, Optional[asyncio.Future], float]] = deque()
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.min_interval = 1.0 / max_rate
+        self.next_write = 0.0
+        self.write_lock = asyncio.Lock()
+        self.timeout = timeout
+        self.listeners: List[Callable[[str, object], None]] = []
+        self.polling: Optional[asyncio.Task] = None
+        self.stats = {"queries": 0, "replies": 0, "errors": 0, "rejected_sets": 0, "timeouts": 0, "unsolicited": 0}
+        self.closed = False
+        os.set_blocking(fd, False)
+        self.loop.add_reader(fd, self._on_readable)
+
+    @classmethod
+    async def open(cls, port: str, baud: int = 38400, **kwargs) -> "CatClient":
+        ser = open_serial(port, baud)
+        return cls(ser.fileno(), serial=ser, **kwargs)
+
+    def _on_readable(self) -> None:
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.close(CatError(f"port error: {e}"))
+            return
+        if not data:
+            self.close(CatError("port closed"))
+            return
+        for reply in self.framer.feed(data):
+            self._on_reply(reply)
+
+    def _expire_sets(self) -> None:
+        # A set command that has drawn no '?;' within the timeout was accepted
+        while self.pending and self.pending[0][1] is None and time.monotonic() - self.pending[0][2] > self.timeout:
+            self.pending.popleft()
+
+    def _on_reply(self, reply: str) -> None:
+        self._expire_sets()
+        if reply == "?":
+            self.stats["errors"] += 1
+            if self.pending:
+                key, future, _ = self.pending.popleft()
+                if future is None:
+                    self.stats["rejected_sets"] += 1
+                    self.state.other["rejected"] = key
+                elif not future.done():
+                    future.set_exception(CatError("radio rejected command"))
+            return
+        self.stats["replies"] += 1
+        key = command_key(reply)
+        try:
+            value = parse_reply(reply)
+        except ValueError:
+            value = reply[len(key):]
+        if self.state.update(key, value):
+            for listener in self.listeners:
+                listener(key, value)
+        for i, (pending_key, future, _) in enumerate(self.pending):
+            if pending_key == key and future is not None:
+                # The radio answers in order, so set commands sent before this query were accepted
+                entries = list(self.pending)
+                self.pending = deque([e for e in entries[:i] if e[1] is not None] + entries[i + 1:])
+                if not future.done():
+                    future.set_result(value)
+                return
+        self.stats["unsolicited"] += 1
+
+    async def write(self, command: str, future: Optional[asyncio.Future] = None) -> None:
+        """Send one command (with or without its ';'), respecting the rate limit. future is the query's, for
+        commands that expect a reply; a set command's rejection is counted in stats['rejected_sets']."""
+        data = (command if command.endswith(";") else command + ";").encode("ascii")
+        async with self.write_lock:
+            delay = self.next_write - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.closed:
+                raise CatError("closed")
+            self._expire_sets()
+            self.pending.append((command_key(command.rstrip(";")), future, time.monotonic()))
+            while data:
+                try:
+                    data = data[os.write(self.fd, data):]
+                except BlockingIOError:
+                    writable = self.loop.create_future()
+                    self.loop.add_writer(self.fd, writable.set_result, None)
+                    try:
+                        await writable
+                    finally:
+                        self.loop.remove_writer(self.fd)
+            self.next_write = time.monotonic() + self.min_interval
+
+    async def query(self, command: str):
+        """Send a query such as 'FA' or 'MD0' and return the typed value of its reply."""
+        async with self.in_flight:
+            future = self.loop.create_future()
+            self.stats["queries"] += 1
+            try:
+                await self.write(command, future)
+                return await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                raise CatError(f"no reply to {command}")
+            finally:
+                if any(e[1] is future for e in self.pending):
+                    self.pending = deque(e for e in self.pending if e[1] is not future)
+
+    async def query_many(self, commands: Iterable[str]) -> list:
+        """Send several queries pipelined; exceptions are returned in place of values."""
+        return await asyncio.gather(*(self.query(c) for c in commands), return_exceptions=True)
+
+    async def set_frequency(self, hz: int, vfo: str = "A") -> None:
+        await self.write(f"F{vfo}{hz:09d};")
+
+    async def set_mode(self, mode: str, vfo: str = "MAIN") -> None:
+        code = MODE_CODES.get(mode.upper(), mode)
+        await self.write(f"MD{'0' if vfo.upper() == 'MAIN' else '1'}{code};")
+
+    def start_polling(self, commands: Iterable[str] = ("FA", "MD0"), interval: float = 0.5) -> asyncio.Task:
+        """Query commands every interval seconds, skipping any whose last query is still outstanding."""
+        if self.polling is not None:
+            self.polling.cancel()
+        self.polling = self.loop.create_task(self._poll(tuple(commands), interval))
+        return self.polling
+
+    async def _poll(self, commands: Tuple[str, ...], interval: float) -> None:
+        outstanding: Dict[str, asyncio.Task] = {}
+        while True:
+            for command in commands:
+                task = outstanding.get(command)
+                if task is None or task.done():
+                    task = self.loop.create_task(self.query(command))
+                    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                    outstanding[command] = task
+            await asyncio.sleep(interval)
+
+    def close(self, error: Optional[CatError] = None) -> None:
+        """Stop polling, fail every outstanding query (with error, if given) and close the port."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.polling is not None:
+            self.polling.cancel()
+        self.loop.remove_reader(self.fd)
+        for _, future, _ in self.pending:
+            if future is not None and not future.done():
+                future.set_exception(error or CatError("closed"))
+        self.pending.clear()
+        if self.serial is not None:
+            self.serial.close()
+        else:
+            os.close(self.fd)
+
+
+class MockFX1:
+    """A simulated FX-1 on a pseudo-terminal: answers FA, FB, MD0/MD1, SM0 and TX queries, accepts the matching
+    set commands, and replies '?;' to anything else. Commands are handled one at a time, each taking processing
+    seconds plus the time its reply's bytes take at baud; every reply then arrives latency seconds later (the
+    USB link's round trip), which a pipelining client can overlap with further commands."""
+
+    def __init__(self, latency: float = 0.004, processing: float = 0.001, baud: int = 115200):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.latency = latency
+        self.processing = processing
+        self.byte_time = 10 / baud
+        self.replies: "queue.Queue[Tuple[float, bytes]]" = queue.Queue()
+        self.state = {"FA": "014074000", "FB": "007074000", "MD0": "C", "MD1": "2", "TX": "0"}
+        self.commands = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        threading.Thread(target=self.deliver, daemon=True).start()
+
+    def reply(self, command: str) -> Optional[str]:
+        key = command_key(command)
+        if key == "SM0" and command == "SM0":
+            return f"SM0{random.randint(0, 255):03d}"
+        if key in self.state:
+            if command == key:
+                return key + self.state[key]
+            self.state[key] = command[len(key):]
+            return None
+        return "?"
+
+    def run(self) -> None:
+        framer = CatFramer()
+        while self.running:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                break
+            for command in framer.feed(data):
+                self.commands += 1
+                reply = self.reply(command)
+                time.sleep(self.processing)
+                if reply is not None:
+                    time.sleep((len(reply) + 1) * self.byte_time)
+                    self.replies.put((time.monotonic() + self.latency, (reply + ";").encode("ascii")))
+
+    def deliver(self) -> None:
+        while self.running:
+            due, data = self.replies.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                os.write(self.master, data)
+            except OSError:
+                break
+
+    def close(self) -> None:
+        self.running = False
+        os.close(self.slave)
+        os.close(self.master)
+
+
+async def benchmark(port: str, baud: int, n: int = 200) -> None:
+    for max_in_flight in (1, 4, 16):
+        cat = await CatClient.open(port, baud, max_in_flight=max_in_flight, max_rate=1000)
+        t0 = time.perf_counter()
+        results = await cat.query_many(["FA", "MD0", "SM0", "TX"] * (n // 4))
+        elapsed = time.perf_counter() - t0
+        errors = sum(isinstance(r, Exception) for r in results)
+        print(f"max_in_flight={max_in_flight:2d}: {n / elapsed:6.0f} queries/s ({errors} errors)")
+        cat.close()
+
+
+async def monitor(port: str, baud: int, interval: float, commands: Iterable[str]) -> None:
+    cat = await CatClient.open(port, baud)
+    cat.listeners.append(lambda key, value: print(f"{time.strftime('%H:%M:%S')} {key} = {value}"))
+    try:
+        await cat.start_polling(commands, interval)
+    finally:
+        cat.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="FX-1 asynchronous CAT engine")
+    parser.add_argument("--port", default=None, help="Serial port path (default: first available from common FX-1 control ports)")
+    parser.add_argument("--baud", type=int, default=38400, help="Baud rate (default: 38400)")
+    parser.add_argument("--mock", action="store_true", help="Talk to a simulated FX-1 on a pty instead of a radio")
+    parser.add_argument("--mock-latency", type=float, default=0.004, help="Simulated link round trip (seconds)")
+    parser.add_argument("--bench", action="store_true", help="Benchmark sequential vs pipelined queries and exit")
+    parser.add_argument("--poll-every", type=float, default=0.5, help="Polling interval (seconds)")
+    parser.add_argument("--poll", default="FA,MD0", help="Comma-separated commands to poll (default: FA,MD0)")
+    args = parser.parse_args()
+
+    mock = None
+    port = args.port
+    if args.mock:
+        mock = MockFX1(args.mock_latency, baud=args.baud)
+        port = mock.port
+        print(f"Mock FX-1 on {port}")
+    elif port is None:
+        port = next((p for p in DEFAULT_PORTS if os.path.exists(p)), None)
+        if port is None:
+            raise SystemExit("No default FX-1 port found; pass --port explicitly or use --mock")
+
+    try:
+        if args.bench:
+            asyncio.run(benchmark(port, args.baud))
+        else:
+            asyncio.run(monitor(port, args.baud, args.poll_every, args.poll.split(",")))
+    except KeyboardInterrupt:
+        print("\nStopping...")
+    finally:
+        if mock is not None:
+            mock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -95,7 +95,9 @@ def read_loop(
     poll_every: Optional[float],
     poll_payload: Optional[bytes],
 ) -> None:
-    buf = bytearray()
+    from fx1_cat import CatFramer
+
+    framer = CatFramer()
     last_poll = 0.0
     while True:
         if poll_every and poll_payload and (time.time() - last_poll) >= poll_every:
@@ -103,7 +105,6 @@ def read_loop(
             last_poll = time.time()
         data = ser.read(256)
         if data:
-            buf.extend(data)
             if raw:
                 sys.stdout.buffer.write(data)
                 sys.stdout.buffer.flush()
@@ -111,11 +112,12 @@ def read_loop(
                 hex_str = data.hex(" ")
                 print(hex_str)
             if parse_fa_enabled:
-                freq = parse_fa(buf)
-                if freq is not None:
-                    print(f"FA: {freq} Hz")
-                    buf.clear()
-                    return
+                # Frame replies as they arrive, rather than re-scanning everything read so far
+                for reply in framer.feed(data):
+                    freq = parse_fa(bytearray(reply + ";", "ascii"))
+                    if freq is not None:
+                        print(f"FA: {freq} Hz")
+                        return
             else:
                 return
 
@@ -0,0 +1,20 @@
+import random
+
+import pytest
+
+from PyFT8 import benchmark
+
+
+def test_random_signals_that_cannot_fit():
+    rng = random.Random(0)
+    assert len(benchmark.random_signals(rng, 10, [0], [200, 3100])) == 10
+    with pytest.raises(ValueError):
+        benchmark.random_signals(rng, 10, [0], [200, 500])
+
+
+def test_unpackable_messages_are_not_sent(monkeypatch):
+    signals = [{'msg': ('CQ', 'G1OJS', 'IO90'), 'f': 1000, 'dt': 0.0, 'snr': 0},
+               {'msg': ('CQ', '1234567', 'IO90'), 'f': 1500, 'dt': 0.0, 'snr': 0}]
+    monkeypatch.setattr(benchmark, 'random_signals', lambda *args: signals)
+    results = benchmark.run_benchmark(1, 2, [0])
+    assert results['decode_rate_vs_snr']['0'] == {'sent': 1, 'decoded': 1, 'rate': 1.0}
@@ -0,0 +1,40 @@
+import random
+
+import numpy as np
+
+from PyFT8.FT8_crc import _crc14, _crc14_bitwise, append_crc, check_crc, check_crc_batch, check_crc_bitwise
+
+
+def random_words(n, seed=0):
+    rng = random.Random(seed)
+    words = []
+    for i in range(n):
+        bits77 = rng.getrandbits(77)
+        # half with a valid CRC, the rest with a random one (a few of which will match by chance)
+        words.append(append_crc(bits77)[0] if i % 2 else (bits77 << 14) | rng.getrandbits(14))
+    return words + [0, append_crc(0)[0]]
+
+
+def to_bits(words):
+    return np.array([[(w >> (90 - i)) & 1 for i in range(91)] for w in words], dtype=np.uint8)
+
+
+def test_crc14_matches_bitwise():
+    rng = random.Random(1)
+    for _ in range(5000):
+        bits77 = rng.getrandbits(77)
+        assert _crc14(bits77) == _crc14_bitwise(bits77)
+
+
+def test_check_crc_matches_bitwise():
+    for word in random_words(5000):
+        assert check_crc(word) == check_crc_bitwise(word)
+
+
+def test_check_crc_batch_matches_bitwise():
+    words = random_words(5000)
+    expected = np.array([check_crc_bitwise(w) is not None for w in words])
+    bits = to_bits(words)
+    assert np.array_equal(check_crc_batch(bits), expected)
+    assert np.array_equal(check_crc_batch(np.packbits(bits, axis=1)), expected)
+    assert expected.sum() >= 2500
@@ -0,0 +1,36 @@
+import time
+
+import numpy as np
+
+from PyFT8.benchmark import synthesize_cycle
+from PyFT8.offline import decode_samples
+from PyFT8.sigspecs import FT8
+from PyFT8.spectrum import Spectrum
+
+
+def test_strong_signal_decodes_at_any_frequency_offset():
+    # A strong signal's sync peak can fall a bin away from the f0 that demaps it
+    rng = np.random.default_rng(0)
+    df = 12000 / 1920 / 2
+    for k in range(8):
+        signal = {'msg': ('CQ', 'G1OJS', 'IO90'), 'f': 1000 + k * df / 4, 'dt': 0.0, 'snr': 30}
+        decodes = decode_samples(synthesize_cycle([signal], rng), 'test')
+        assert [d['msg'] for d in decodes] == ['CQ G1OJS IO90'], signal['f']
+
+
+def test_passes_stop_at_max_hop():
+    rng = np.random.default_rng(1)
+    signal = {'msg': ('CQ', 'G1OJS', 'IO90'), 'f': 1000, 'dt': 0.0, 'snr': 0}
+    spectrum = Spectrum(FT8, 12000, 3100, 4, 2)
+    spectrum.audio_in.load_samples(synthesize_cycle([signal], rng))
+    # only candidates whose payload ends below max_hop are decoded
+    for deadline in (None, time.time() + 60):
+        assert not len(spectrum.search_and_decode(range(64, 960), 'test', deadline = deadline, max_hop = 200)[1])
+        assert len(spectrum.search_and_decode(range(64, 960), 'test', deadline = deadline, max_hop = 340)[1])
+    # and subtraction leaves the hops from max_hop on alone
+    table, decoded = spectrum.search_and_decode(range(64, 960), 'test')
+    before = spectrum.audio_in.dB_main.copy()
+    spectrum.subtract_decodes(table, decoded[:1], max_hop = 200)
+    after = spectrum.audio_in.dB_main
+    assert np.array_equal(after[200:], before[200:])
+    assert np.any(after[:200] < before[:200])
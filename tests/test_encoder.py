@@ -0,0 +1,26 @@
+import random
+
+import numpy as np
+
+from PyFT8.FT8_encoder import encode_bits77, encode_bits77_batch, pack_message, pack_messages
+
+
+def test_encode_bits77_batch_matches_encode_bits77():
+    rng = random.Random(0)
+    words = [rng.getrandbits(77) for _ in range(2000)] + [0, (1 << 77) - 1]
+    bits77 = np.array([[(w >> (76 - i)) & 1 for i in range(77)] for w in words], dtype=np.uint8)
+    symbols = encode_bits77_batch(bits77)
+    assert symbols.shape == (len(words), 79)
+    for word, row in zip(words, symbols):
+        assert row.tolist() == encode_bits77(word)[0]
+
+
+def test_pack_messages_matches_pack_message():
+    msgs = [("CQ", "G1OJS", "IO90"), ("G1OJS/P", "G1OJS/P", "IO90"), ("WM3PEN", "EA6VQ", "-08"),
+            ("E67A/P", "EA6VQ", "-08"), ("CQ", "CT7ARQ/P", "IN51"), ("EA6VQ", "WM3PEN", "RR73"),
+            ("EA6VQ", "WM3PEN", "R-12"), ("CQ", "G1OJS", ""), ("G1OJS", "EA6VQ", "73"), ("CQ", "TOOLONGCALLSIGN", "IO90")]
+    symbols, valid = pack_messages(msgs)
+    assert valid.tolist() == [len(pack_message(*msg)) > 0 for msg in msgs]
+    assert not valid.all()
+    for msg, row, ok in zip(msgs, symbols, valid):
+        assert row.tolist() == (pack_message(*msg) if ok else [0] * 79)
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import tty
+
+import pytest
+
+from fx1_cat import CatClient, CatError, CatFramer, MockFX1
+
+
+@pytest.fixture
+def mock():
+    radio = MockFX1(latency=0.002)
+    yield radio
+    if radio.running:
+        radio.close()
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def test_framer_joins_partial_frames():
+    framer = CatFramer()
+    assert framer.feed(b"FA0140") == []
+    assert framer.feed(b"74000;MD") == ["FA014074000"]
+    assert framer.feed(b"0C;TX0;") == ["MD0C", "TX0"]
+
+
+def test_framer_drops_garbage():
+    framer = CatFramer(max_len=16)
+    assert framer.feed(b"\x00\xff;FA014074000;") == ["FA014074000"]
+    assert framer.feed(b"X" * 40) == []
+    assert framer.feed(b";MD0C;") == ["MD0C"]
+
+
+def test_query_many_is_pipelined(mock):
+    async def main():
+        cat = await CatClient.open(mock.port, max_in_flight=8, max_rate=1000)
+        try:
+            results = await cat.query_many(["FA", "MD0", "FB", "TX"] * 10)
+            return results, cat.state, cat.stats
+        finally:
+            cat.close()
+
+    results, state, stats = run(main())
+    assert results == [14074000, "DATA-U", 7074000, False] * 10
+    assert (state.freq_a, state.mode_main) == (14074000, "DATA-U")
+    assert stats["replies"] == 40 and stats["timeouts"] == 0
+
+
+def test_rejected_query(mock):
+    async def main():
+        cat = await CatClient.open(mock.port)
+        try:
+            with pytest.raises(CatError):
+                await cat.query("ZZ")
+            return await cat.query("FA")
+        finally:
+            cat.close()
+
+    assert run(main()) == 14074000
+
+
+def test_rejected_set_does_not_fail_next_query(mock):
+    async def main():
+        cat = await CatClient.open(mock.port)
+        try:
+            await cat.write("ZZ1;")
+            freq = await cat.query("FA")
+            await cat.set_frequency(7074000)
+            return freq, await cat.query("FA"), cat.stats
+        finally:
+            cat.close()
+
+    first, second, stats = run(main())
+    assert (first, second) == (14074000, 7074000)
+    assert stats["rejected_sets"] == 1
+
+
+def test_polling_updates_state(mock):
+    async def main():
+        cat = await CatClient.open(mock.port)
+        changes = []
+        cat.listeners.append(lambda key, value: changes.append((key, value)))
+        try:
+            cat.start_polling(("FA", "MD0"), interval=0.02)
+            await asyncio.sleep(0.1)
+            mock.state["FA"] = "021074000"
+            await asyncio.sleep(0.1)
+            return cat.state, changes
+        finally:
+            cat.close()
+
+    state, changes = run(main())
+    assert state.freq_a == 21074000 and state.mode_main == "DATA-U"
+    assert ("FA", 14074000) in changes and ("FA", 21074000) in changes
+
+
+def test_port_closed_fails_pending_queries():
+    async def main():
+        # A pty whose other end goes away reads as EIO, like an unplugged USB serial port
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        cat = CatClient(slave, timeout=5.0)
+        query = asyncio.ensure_future(cat.query("FA"))
+        await asyncio.sleep(0.05)
+        os.close(master)
+        with pytest.raises(CatError, match="port"):
+            await query
+        with pytest.raises(CatError):
+            await cat.query("FA")
+        return cat.closed
+
+    assert run(main())
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from PyFT8.spectrogram_archive import SpectrogramArchive
+
+
+def test_reopen_checks_shape_ncycles_and_encoding(tmp_path):
+    archive = SpectrogramArchive(str(tmp_path), 10, 20, 4, 'float16')
+    dB = np.random.default_rng(0).normal(-60, 6, (10, 20))
+    cyclestart_str = archive.store(dB, 30)
+    archive.flush()
+
+    for reopened in (SpectrogramArchive(str(tmp_path)), SpectrogramArchive(str(tmp_path), 10, 20, encoding='float16')):
+        assert reopened.cycles() == [cyclestart_str]
+    reopened = SpectrogramArchive(str(tmp_path), ncycles=4, cycle_seconds=15)
+    assert (reopened.ncycles, reopened.cycle_seconds) == (4, 15)
+    for args in ((11, 20), (10, 21), (10, 20, 4, 'uint8'), (10, 20, 8), (10, 20, 4, 'float16', 30)):
+        with pytest.raises(ValueError):
+            SpectrogramArchive(str(tmp_path), *args)
@@ -0,0 +1,34 @@
+import numpy as np
+
+from PyFT8.sigspecs import FT8
+from PyFT8.spectrum import Spectrum
+
+
+def get_sync(spectrum, f0_idx, dB, sync_idx):
+    # Reference: the per-frequency sync search that get_sync_all replaces
+    best_sync = {'h0_idx': 0, 'score': 0, 'dt': 0}
+    for h0_idx in spectrum.search_hops_range:
+        hops = h0_idx + spectrum.hop_idxs_Costas + sync_idx * 36 * spectrum.hops_persymb
+        sync_score = float(np.dot(dB[hops, :].ravel(), spectrum.csync_flat))
+        if sync_score > best_sync['score']:
+            best_sync = {'h0_idx': h0_idx, 'score': sync_score, 'dt': h0_idx * spectrum.dt - 0.7}
+    return best_sync
+
+
+def test_get_sync_all_matches_get_sync():
+    spectrum = Spectrum(FT8, 12000, 3100, 4, 2)
+    rng = np.random.default_rng(0)
+    f0_idxs = np.arange(60, 900, 7)
+    for _ in range(3):
+        dB_main = rng.normal(-60, 6, spectrum.audio_in.dB_main.shape).astype(np.float32)
+        for sync_idx in (0, 1):
+            h0, score, dt = spectrum.get_sync_all(f0_idxs, dB_main, sync_idx)
+            # scores are differences of large sums, so float32 rounding is relative to the largest of them
+            atol = 2.5e-5 * np.abs(score).max()
+            for i, f0_idx in enumerate(f0_idxs):
+                dB = dB_main[:, f0_idx:f0_idx + spectrum.fbins_per_signal]
+                best = get_sync(spectrum, f0_idx, dB - np.max(dB), sync_idx)
+                assert score[i] == np.float32(0) or best['score'] > 0
+                np.testing.assert_allclose(score[i], best['score'], rtol=2.5e-5, atol=atol)
+                if best['score'] > atol:
+                    assert h0[i] == best['h0_idx'] and np.isclose(dt[i], best['dt'])
@@ -0,0 +1,36 @@
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from PyFT8.sigspecs import FT8
+from PyFT8.spectrum import Spectrum
+from PyFT8.spectrum_ring import SpectrumRing
+
+
+@pytest.fixture
+def shm_name():
+    return f"pyft8_test_{os.getpid()}"
+
+
+def test_replaces_stale_segment(shm_name):
+    stale = shared_memory.SharedMemory(name = shm_name, create = True, size = 64)
+    stale.close()
+    ring = SpectrumRing(8, 4, shm_name, df = 3.125)
+    try:
+        assert ring.shm.size >= ring.rows.nbytes
+        ring.publish(np.ones((3, 4), dtype = np.float32))
+        rows, seen = ring.read_since(0)
+        assert seen == 3 and rows.shape == (3, 4) and ring.df == 3.125
+    finally:
+        ring.close()
+
+
+def test_audio_in_close_unlinks_ring(shm_name):
+    spectrum = Spectrum(FT8, 12000, 3100, 4, 2)
+    spectrum.audio_in.enable_spectrum_ring(spectrum.df, shm_name = shm_name)
+    spectrum.audio_in.close()
+    assert spectrum.audio_in.spectrum_ring is None
+    with pytest.raises(FileNotFoundError):
+        SpectrumRing.attach(shm_name)